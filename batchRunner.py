@@ -0,0 +1,367 @@
+""" batchRunner.py
+    agent 19Oct2026
+
+    Run a queue of stacking jobs without anyone at the keyboard.
+
+    Each job is a JSON file describing one subject. The printer and camera
+    are connected once and reused for every job in the queue. Jobs run one
+    after another and a summary of every job is rewritten after each one,
+    so an overnight run can be checked in the morning (or part way through).
+
+    Example job file:
+    {
+        "name": "beetle",
+        "fStop": 4,              (or "plan" to let shotPlanner pick it)
+        "focalLen": 100,
+        "subjectDist": 300,
+        "subjectLen": 20,
+        "shotDirection": 1,      (1 Front to Back, -1 Back to Front)
+        "yAxis": 110,            (starting Y position of bed)
+        "zMove": 0,              (mm to move Z axis before shooting)
+        "outputDir": "beetle_01",
+        "transfer": "copy",      ("copy", "preview", "pack" or "none")
+        "originals": "demand",   (preview only, "idle" fetches them after the queue)
+        "profile": "macro",      (optional camera settings profile, see cameraSettings.py)
+        "bracket": {"key": "tv", "values": ["1/250", "1/125", "1/60"]}  (optional)
+    }
+    A bracket shoots one frame per value at every slice.
+    The "preview" transfer copies small display JPEGs of every image into
+    outputDir/preview right away. Originals are fetched with previewTransfer.py
+    for the slices picked, or for every image once the whole queue is shot.
+    The "pack" transfer downloads every image into one outputDir/<name>.stack
+    file along with the shot parameters (see stackContainer.py).
+    Add "pipeline": ["rename", "cache", "xmp", "thumbnail"] to a "copy" job to
+    copy and process each image while the stack is still being shot (see
+    postPipeline.py). The "cache" stage decodes each image into the frame
+    cache (see frameCache.py), which is otherwise not filled by batch jobs.
+    Add "mosaic": {"width": 60, "height": 40, "overlap": 0.2} (mm along X and Z)
+    to shoot a grid of stacks covering a subject larger than one frame (see
+    mosaicPlanner.py).
+
+    Usage:
+       python batchRunner.py [--summary summary.json] [--trace trace.json] [--metrics 9464] [--rig name] jobFileOrDir ...
+    Directories are expanded to the *.json files they hold, in name order.
+"""
+import os
+import sys
+import json
+import glob
+import argparse
+from datetime import datetime
+from r5_cameraUtils import (
+    createR5Session,
+    stackingPositions,
+    copyFiles,
+    preflightCheck,
+    printPreflight,
+)
+from traceUtils import enableTracing
+from metricsUtils import (
+    setRig,
+    startMetricsServer,
+)
+from settleModel import (
+    RIG_NAME,
+    loadSettle,
+)
+from cameraSettings import (
+    PROFILE_FILE,
+    SettingsCache,
+    loadProfiles,
+    bracketSets,
+)
+from stackContainer import packFiles
+from previewTransfer import (
+    copyPreviews,
+    fetchOriginals,
+)
+from mosaicPlanner import (
+    planMosaic,
+    runMosaic,
+)
+from gcodeUtils import (
+    connect3dPrinter,
+    slowMove,
+)
+from macroPhotoShooter import (
+    setupPrinter,
+    captureStack,
+)
+from postPipeline import (
+    Pipeline,
+    CopyFeed,
+    buildStages,
+)
+
+JOB_DEFAULTS = {
+    "fStop": 2.8,
+    "focalLen": 100,
+    "shotDirection": 1,
+    "yAxis": 110,
+    "zMove": 0,
+    "outputDir": "",
+    "transfer": "copy",
+    "originals": "demand",
+    "profile": None,
+    "profileFile": PROFILE_FILE,
+    "bracket": None,
+    "pipeline": None,
+}
+TRANSFER_POLICIES = ("copy", "preview", "pack", "none")
+SHOT_PARAMS = ("name", "fStop", "focalLen", "subjectDist", "subjectLen", "shotDirection",
+               "yAxis", "profile", "bracket")
+ORIGINALS_POLICIES = ("demand", "idle")
+
+
+def loadJob(jobPath):
+    """ Read a job file and fill in defaults
+
+    Returns:
+       job - dictionary of job settings. Raises ValueError if a setting is invalid
+    """
+    with open(jobPath) as f:
+        job = json.load(f)
+    job.setdefault("name", os.path.splitext(os.path.basename(jobPath))[0])
+    return checkJob(job, jobPath)
+
+
+def checkJob(job, jobPath):
+    """ Fill in defaults of a job dictionary and validate it
+
+    Returns:
+       job - new dictionary of job settings. Raises ValueError if a setting is invalid
+    """
+    job = dict(JOB_DEFAULTS, **job)
+    job.setdefault("name", jobPath)
+    for key in ("subjectDist", "subjectLen"):
+        if key not in job:
+            raise ValueError("job {} is missing {}".format(jobPath, key))
+    if job["transfer"] not in TRANSFER_POLICIES:
+        raise ValueError("job {} has unknown transfer {}".format(jobPath, job["transfer"]))
+    if job["originals"] not in ORIGINALS_POLICIES:
+        raise ValueError("job {} has unknown originals {}".format(jobPath, job["originals"]))
+    if job["shotDirection"] not in (1, -1):
+        raise ValueError("job {} shotDirection must be 1 or -1".format(jobPath))
+    bracket = job["bracket"]
+    if bracket is not None and not (isinstance(bracket, dict) and bracket.get("key")
+                                    and isinstance(bracket.get("values"), list)
+                                    and bracket["values"]):
+        raise ValueError("job {} bracket needs a key and a list of values".format(jobPath))
+    if job["pipeline"] is not None:
+        if job["transfer"] != "copy" or job.get("mosaic"):
+            raise ValueError("job {} pipeline needs the copy transfer and no mosaic".format(jobPath))
+        buildStages(job["pipeline"])  # raises ValueError for an unknown stage
+    mosaic = job.get("mosaic")
+    if mosaic is not None:
+        for key in ("width", "height"):
+            if key not in mosaic:
+                raise ValueError("job {} mosaic is missing {}".format(jobPath, key))
+        if not 0 <= mosaic.get("overlap", 0.2) < 1:
+            raise ValueError("job {} mosaic overlap must be 0 to <1".format(jobPath))
+    return job
+
+
+def expandQueue(paths):
+    """ Job file paths in run order. Directories add their *.json files
+    """
+    queue = []
+    for path in paths:
+        if os.path.isdir(path):
+            queue.extend(sorted(glob.glob(os.path.join(path, "*.json"))))
+        else:
+            queue.append(path)
+    return queue
+
+
+def planJob(job):
+    """ Y position of every shot for a job
+    """
+    fStop = job["fStop"]
+    if fStop == "plan":
+        from shotPlanner import planShots  # needs numpy
+        plans = planShots(job["subjectLen"], job["subjectDist"],
+                          focalLens=(job["focalLen"],), shotDirection=job["shotDirection"])
+        if not plans:
+            raise ValueError("no valid shot plan for job " + job["name"])
+        fStop = plans[0]["fStop"]
+        job["fStop"] = fStop
+    return stackingPositions(job["subjectDist"], job["subjectLen"],
+                             fStop=fStop, focalLen=job["focalLen"],
+                             shotDirection=job["shotDirection"])
+
+
+def shotParams(job):
+    """ Settings of a job worth keeping with its images
+    """
+    return {key: job.get(key) for key in SHOT_PARAMS}
+
+
+def runJob(prtConn, r5Session, job, settleModel=None):
+    """ Shoot one job and transfer its images
+
+    settleModel - optional settleModel.SettleModel of the rig (see captureStack)
+
+    Returns:
+       result - dictionary summarising the job
+    """
+    result = {"name": job["name"], "status": "failed", "start": datetime.now().isoformat(),
+              "originals": job["originals"]}
+    positions = planJob(job)
+    settings = brackets = None
+    if job["profile"] or job["bracket"]:
+        settings = SettingsCache(r5Session)
+    if job["bracket"]:
+        brackets = bracketSets(job["bracket"]["key"], job["bracket"]["values"])
+    frames = len(brackets) if brackets else 1
+    result["numShots"] = len(positions) * frames
+    result["fStop"] = job["fStop"]
+    plan = None
+    if job.get("mosaic"):
+        mosaic = job["mosaic"]
+        plan = planMosaic(mosaic["width"], mosaic["height"], job["subjectDist"],
+                          job["focalLen"], positions, mosaic.get("overlap", 0.2),
+                          job["shotDirection"])
+        result["numTiles"] = len(plan["tiles"])
+        result["numShots"] = len(positions) * frames * len(plan["tiles"])
+
+    if job["transfer"] == "pack":
+        # a pack only ever holds one session, refuse before anything is shot
+        pattern = "tile_r*_c*.stack" if plan is not None else job["name"] + ".stack"
+        existing = glob.glob(os.path.join(glob.escape(job["outputDir"]), pattern))
+        if existing:
+            result["status"] = "refused"
+            result["error"] = "{} already holds a session".format(existing[0])
+            return result
+
+    # nobody is there to swap a battery or card, so anything short is refused
+    report = preflightCheck(r5Session, result["numShots"])
+    printPreflight(report)
+    if not report["action"] == "ok":
+        result["status"] = "refused"
+        result["error"] = report["reason"]
+        return result
+
+    if job["profile"]:
+        result["profileChanges"] = settings.apply(loadProfiles(job["profileFile"])[job["profile"]])
+
+    setupPrinter(prtConn, homePrt=True, yAxis=job["yAxis"], zMove=job["zMove"])
+    if plan is not None:
+        start = datetime.now()
+        index = runMosaic(prtConn, r5Session, plan, job["outputDir"], job["transfer"],
+                          settings=settings, brackets=brackets,
+                          settleModel=settleModel, params=shotParams(job))
+        result["images"] = [f for tile in index["tiles"] for f in tile["files"]]
+        if job["transfer"] == "preview":
+            result["previewDirs"] = [tile["dir"] for tile in index["tiles"]]
+        result["elapsedSec"] = (datetime.now() - start).total_seconds()
+        result["status"] = "done" if len(result["images"]) >= result["numShots"] else "incomplete"
+        return result
+
+    pipeline = feed = None
+    if job["transfer"] == "copy" and job["pipeline"]:
+        # images are copied and processed while the stack is still being shot
+        pipeline = Pipeline(buildStages(job["pipeline"]), positions, shotParams(job), frames)
+        if job["outputDir"]:
+            os.makedirs(job["outputDir"], exist_ok=True)
+        feed = CopyFeed(r5Session, job["outputDir"], onSaved=pipeline.onSaved)
+    try:
+        addedList, elapsed, endY = captureStack(prtConn, r5Session, positions,
+                                                job["shotDirection"], settings=settings,
+                                                brackets=brackets, settleModel=settleModel,
+                                                onFiles=feed)
+        slowMove(prtConn, y=-round(endY * job["shotDirection"], 2))  # back to start
+    finally:
+        if feed is not None:
+            result["copied"] = feed.close()
+            result["processed"] = len(pipeline.close())
+            result["pipelineErrors"] = pipeline.errors
+    result["images"] = addedList
+    result["elapsedSec"] = elapsed.total_seconds()
+
+    if job["transfer"] == "copy" and feed is None:
+        result["copied"] = copyFiles(r5Session, addedList, dirName=job["outputDir"])
+    elif job["transfer"] == "preview":
+        result["copied"] = copyPreviews(r5Session, addedList, job["outputDir"])
+        result["previewDirs"] = [job["outputDir"]]
+    elif job["transfer"] == "pack":
+        packPath = os.path.join(job["outputDir"], job["name"] + ".stack")
+        params = dict(shotParams(job), elapsedSec=result["elapsedSec"], start=result["start"])
+        result["packed"] = packFiles(r5Session, addedList, packPath, positions, params, frames)
+        result["pack"] = packPath
+    result["status"] = "done" if len(addedList) >= result["numShots"] else "incomplete"
+    return result
+
+
+def writeSummary(summaryPath, results):
+    tmpPath = summaryPath + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmpPath, summaryPath)
+
+
+def runQueue(prtConn, r5Session, jobPaths, summaryPath="batch_summary.json",
+             settleModel=None):
+    """ Run every job in order, one failed job does not stop the queue
+
+    Returns:
+       results - list of job summaries, also written to summaryPath
+    """
+    results = []
+    for n, jobPath in enumerate(jobPaths, 1):
+        print("\n\t --- Job {} of {}: {} ---".format(n, len(jobPaths), jobPath))
+        try:
+            result = runJob(prtConn, r5Session, loadJob(jobPath), settleModel)
+        except Exception as ex:
+            print("\t Job failed: ", ex)
+            result = {"name": jobPath, "status": "failed", "error": str(ex)}
+        result["jobFile"] = jobPath
+        results.append(result)
+        writeSummary(summaryPath, results)
+
+    # rig is idle now, fetch the originals of preview jobs that want them all
+    for result in results:
+        if result.get("originals") == "idle" and result.get("previewDirs"):
+            print("\n\t --- Fetching originals of {} ---".format(result["name"]))
+            result["originalsFetched"] = sum(
+                len(fetchOriginals(r5Session, d))
+                for d in result["previewDirs"])
+            writeSummary(summaryPath, results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run stacking jobs unattended")
+    parser.add_argument("jobs", nargs="+", help="job files or directories of job files")
+    parser.add_argument("--summary", default="batch_summary.json",
+                        help="where to write the results of every job")
+    parser.add_argument("--trace", help="record a Chrome trace of the run to this file")
+    parser.add_argument("--metrics", type=int, metavar="PORT",
+                        help="serve live Prometheus metrics on this port")
+    parser.add_argument("--rig", default=RIG_NAME,
+                        help="rig whose calibrated settle times are used (see settleModel.py)")
+    args = parser.parse_args()
+    if args.trace:
+        enableTracing(args.trace)
+    if args.metrics:
+        startMetricsServer(args.metrics)
+    setRig(args.rig)
+
+    jobPaths = expandQueue(args.jobs)
+    for jobPath in jobPaths:
+        loadJob(jobPath)  # catch typos before any bed movement
+
+    prtConn, prtReady = connect3dPrinter()
+    r5Session, camReady = createR5Session()
+    if not (prtReady and camReady):
+        print("\t Printer connected: ", prtReady, "  Camera connected: ", camReady)
+        sys.exit(1)
+
+    results = runQueue(prtConn, r5Session, jobPaths, args.summary, loadSettle(args.rig))
+    done = sum(1 for r in results if r["status"] == "done")
+    print("\n\t {} of {} jobs done. Summary in {}".format(done, len(results), args.summary))
+    prtConn.close()
+    r5Session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+""" cameraSettings.py
+    agent 19Oct2026
+
+    Shooting settings of the camera: read once, change only what differs.
+
+    The whole CCAPI shooting/settings tree (drive mode, AF, Tv, Av, ISO,
+    exposure compensation, white balance, ...) is read in one request into a
+    cache. Applying a named profile, or one frame of an exposure bracket,
+    compares it with the cache and PUTs only the keys that changed, several
+    at a time when allowed. Each PUT reply updates the cache, and events the
+    shooting loop polls anyway (a dial turned on the camera) are fed back in
+    so the cache never goes stale.
+
+    A bracket of three Tv values then costs two PUTs per slice, not a full
+    settings write, since brackets are shot in alternating order so each slice
+    starts on the setting the previous one ended on.
+
+    Example profile file (camera_profiles.json):
+    {
+        "macro": {"drive": "single", "afoperation": "manual", "av": "f8.0", "iso": "100"},
+        "macro_hdr": {"drive": "single", "av": "f8.0", "iso": "100", "tv": "1/125"}
+    }
+
+    Usage:
+       python cameraSettings.py [profileName]
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from r5_cameraUtils import (
+    API_URL,
+    sendR5CcapiReq,
+    sendR5CcapiPut,
+)
+
+SETTINGS_PATH = "/ccapi/ver100/shooting/settings"
+PROFILE_FILE = "camera_profiles.json"
+SEQUENTIAL_KEYS = ("shootingmode", "drive", "afoperation")  # later keys depend on these
+SETTINGS_WORKERS = 2  # concurrent PUTs, 1 for cameras that answer busy to overlaps
+BUSY_RETRIES = 5
+
+
+class SettingsCache:
+    """ Cached shooting settings of one camera
+
+    Args:
+      session: Session object currently connected to camera
+      apiURL: domain and port URL of the camera
+      workers: number of PUTs sent at the same time
+    """
+
+    def __init__(self, session, apiURL=API_URL, workers=SETTINGS_WORKERS):
+        self.session = session
+        self.apiURL = apiURL
+        self.workers = workers
+        self.values = {}
+        self.abilities = {}
+        self.puts = 0  # PUT requests sent, to see what a run cost
+
+    def load(self):
+        """ Read every shooting setting in one request
+        """
+        response = sendR5CcapiReq(self.session, SETTINGS_PATH, self.apiURL)
+        if response == {} or response.status_code != 200:
+            raise ConnectionError("SettingsCache: could not read " + SETTINGS_PATH)
+        self.values = {}
+        self.abilities = {}
+        for key, item in response.json().items():
+            if isinstance(item, dict) and "value" in item:
+                self.values[key] = item["value"]
+                self.abilities[key] = item.get("ability")
+        return self.values
+
+    def applyEvent(self, event):
+        """ Update the cache from a polled event, which lists changed settings
+        """
+        for key, item in (event or {}).items():
+            if key in self.values and isinstance(item, dict) and "value" in item:
+                self.values[key] = item["value"]
+                if "ability" in item:
+                    self.abilities[key] = item["ability"]
+
+    def diff(self, settings):
+        """ Settings that differ from the cache. Raises ValueError for a value
+        the camera does not offer
+        """
+        if not self.values:
+            self.load()
+        changes = {}
+        for key, value in settings.items():
+            if key not in self.values:
+                raise ValueError("SettingsCache: camera has no setting " + key)
+            ability = self.abilities.get(key)
+            if isinstance(ability, list) and value not in ability:
+                raise ValueError("SettingsCache: {} can not be set to {}".format(key, value))
+            if self.values[key] != value:
+                changes[key] = value
+        return changes
+
+    def _put(self, key, value):
+        resource = SETTINGS_PATH + "/" + key
+        for attempt in range(BUSY_RETRIES):
+            resp = sendR5CcapiPut(self.session, resource, {"value": value}, self.apiURL)
+            self.puts += 1
+            if resp == {} or not resp.status_code == 503:
+                break
+            time.sleep(0.1)  # camera busy
+        if resp == {} or resp.status_code != 200:
+            self.values[key] = None  # unknown now, so the next apply sends it again
+            raise ConnectionError("SettingsCache: could not set {} to {}".format(key, value))
+        self.values[key] = resp.json().get("value", value)
+
+    def apply(self, settings):
+        """ Send only the settings that changed
+
+        Returns:
+           changes - dictionary of the settings that were sent
+        """
+        changes = self.diff(settings)
+        for key in SEQUENTIAL_KEYS:
+            if key in changes:
+                self._put(key, changes[key])
+        rest = [key for key in changes if key not in SEQUENTIAL_KEYS]
+        if len(rest) > 1 and self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                list(pool.map(lambda key: self._put(key, changes[key]), rest))
+        else:
+            for key in rest:
+                self._put(key, changes[key])
+        return changes
+
+
+def loadProfiles(profilePath=PROFILE_FILE):
+    with open(profilePath) as f:
+        return json.load(f)
+
+
+def bracketSets(key, values):
+    """ One settings dictionary per frame of a bracket, i.e. bracketSets("tv", ["1/250", "1/125"])
+    """
+    return [{key: value} for value in values]
+
+
+def bracketOrder(brackets, shotNum):
+    """ Bracket frames of a slice, reversed on every other slice so a slice
+    starts with the setting the last one ended on
+    """
+    return brackets if shotNum % 2 == 0 else list(reversed(brackets))
+
+
+def main():
+    import sys
+    from r5_cameraUtils import createR5Session
+
+    # show the camera's settings, or apply the profile named on the command line
+    r5Session, camReady = createR5Session()
+    if not camReady:
+        raise SystemExit("\t Camera is not connected")
+    try:
+        settings = SettingsCache(r5Session)
+        for key, value in sorted(settings.load().items()):
+            print("\t {:<24} {}".format(key, value))
+        if len(sys.argv) > 1:
+            changes = settings.apply(loadProfiles()[sys.argv[1]])
+            print("\t Profile {} changed: {}".format(sys.argv[1], changes or "nothing"))
+    finally:
+        r5Session.close()
+
+
+if __name__ == "__main__":
+    main()
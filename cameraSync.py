@@ -0,0 +1,275 @@
+""" cameraSync.py
+    agent 19Oct2026
+
+    Bring a local folder up to date with a camera folder.
+
+    CCAPI lists a folder 100 entries per page. All pages are fetched at the
+    same time, the listing is compared with a manifest kept in the local
+    folder, and only the files that are new (or changed, or missing locally)
+    are downloaded, several at once. Re-syncing a folder of thousands of
+    images that is already up to date costs one request per page.
+
+    The manifest (.ccapi_manifest.json) maps each camera resource path to the
+    local file name, size and the camera's last modified date, both taken from
+    the reply headers (of the download, or of a HEAD request when checking a
+    file). It is rewritten after every batch of downloads so an interrupted
+    sync loses little.
+
+    The listing only holds names, so a file that changed under a known name
+    (i.e. a formatted card numbering from IMG_0001 again) is found by checking
+    the first and last known files of the folder on every sync. If either
+    differs, every known file is checked. --verify always checks them all.
+
+    Usage:
+       python cameraSync.py [--verify] [--camera-dir /ccapi/ver110/contents/sd/100CANON] localDir
+"""
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from r5_cameraUtils import (
+    API_URL,
+    createR5Session,
+    getCurrentDir,
+    getNumDirEntries,
+    sendR5CcapiReq,
+    getImageStream,
+    getImageHead,
+)
+from traceUtils import span
+from metricsUtils import inc, observe
+
+MANIFEST_NAME = ".ccapi_manifest.json"
+SYNC_WORKERS = 4  # concurrent requests, the camera refuses too many connections
+MANIFEST_EVERY = 25  # downloads between manifest rewrites
+CHUNK_SIZE = 256 * 1024
+
+
+def listPage(session, path, page, apiURL=API_URL):
+    """ Resource paths on one page (1 based) of a camera folder
+    """
+    response = sendR5CcapiReq(session, "{}?page={}".format(path, page), apiURL)
+    if response == {} or response.status_code != 200:
+        raise ConnectionError("listPage: could not list page {} of {}".format(page, path))
+    return response.json().get("url", [])
+
+
+def listFolder(session, path, apiURL=API_URL, workers=SYNC_WORKERS):
+    """ Every resource path in a camera folder, all pages fetched concurrently
+
+    Returns:
+       urls - resource paths in camera order
+    """
+    number, pageCount = getNumDirEntries(session, path, apiURL)
+    if not number:
+        return []
+    pageCount = pageCount or 1  # not every camera reports it
+    with span("listFolder", "transfer", pages=pageCount):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pages = pool.map(lambda page: listPage(session, path, page, apiURL),
+                             range(1, pageCount + 1))
+            return [url for urls in pages for url in urls]
+
+
+def _headerInfo(response):
+    size = response.headers.get("Content-Length")
+    return {"size": int(size) if size else None,
+            "modified": response.headers.get("Last-Modified")}
+
+
+def fileInfo(session, resourcePath, apiURL=API_URL):
+    """ Size and last modified date of one file, from a HEAD request so no
+    image data is sent. A camera that refuses HEAD is asked with a streamed
+    download, closed before any of the body is read. None if the camera did
+    not answer
+    """
+    response = getImageHead(session, resourcePath, apiURL)
+    if response == {}:
+        return None
+    if response.status_code not in (405, 501):
+        return _headerInfo(response) if response.status_code == 200 else None
+    response = getImageStream(session, resourcePath, apiURL)
+    if response == {}:
+        return None
+    try:
+        return _headerInfo(response) if response.status_code == 200 else None
+    finally:
+        response.close()
+
+
+def downloadFile(session, resourcePath, localDir, apiURL=API_URL, onSaved=None):
+    """ Stream one camera file into localDir
+
+    Returns:
+       (fileName, info) - info is the size and date from the reply headers,
+                          None if the file was not saved
+    """
+    start = time.perf_counter()
+    response = getImageStream(session, resourcePath, apiURL)
+    if response == {}:
+        return None
+    fileName = resourcePath.split("/")[-1]
+    localPath = os.path.join(localDir, fileName)
+    partPath = localPath + ".part"
+    try:
+        if response.status_code != 200:
+            print("\t downloadFile: camera answered {} for {}".format(
+                response.status_code, resourcePath))
+            return None
+        info = _headerInfo(response)
+        with open(partPath, "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(partPath, localPath)  # never a half file under the real name
+    finally:
+        response.close()
+        if os.path.exists(partPath):
+            os.remove(partPath)  # the download broke off
+    observe("mps_transfer_seconds", time.perf_counter() - start)
+    inc("mps_transfer_bytes_total", os.path.getsize(localPath))
+    if onSaved is not None:
+        try:
+            onSaved(os.path.abspath(localPath))
+        except Exception as e:
+            print("\t downloadFile: onSaved failed for ", fileName, ": ", e)
+    return fileName, info
+
+
+def _changed(info, entry):
+    return info is None or info["size"] != entry["size"] or info["modified"] != entry["modified"]
+
+
+def loadManifest(localDir):
+    path = os.path.join(localDir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        print("\t Manifest {} is damaged, every file will be checked".format(path))
+        return {}
+
+
+def writeManifest(localDir, manifest):
+    path = os.path.join(localDir, MANIFEST_NAME)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmpPath, path)
+
+
+def _isCurrent(entry, localDir):
+    # manifest says we have it and the local copy is still there and whole
+    localPath = os.path.join(localDir, entry["local"])
+    return os.path.exists(localPath) and os.path.getsize(localPath) == entry["localSize"]
+
+
+def diffFolder(session, urls, manifest, localDir, apiURL=API_URL, verify=False,
+               workers=SYNC_WORKERS):
+    """ Camera files that need downloading
+
+    Files not in the manifest, or whose local copy is missing or a different
+    size, are always fetched. The camera's size and modified date of the
+    first and last known files are checked. If either changed, or with verify,
+    every known file is checked, which costs one request per file.
+
+    Returns:
+       needed - list of resource paths
+    """
+    needed = []
+    known = []
+    for url in urls:
+        entry = manifest.get(url)
+        if entry is None or not _isCurrent(entry, localDir):
+            needed.append(url)
+        else:
+            known.append(url)
+
+    if known and not verify:
+        probes = list(dict.fromkeys((known[0], known[-1])))
+        verify = any(_changed(fileInfo(session, url, apiURL), manifest[url]) for url in probes)
+        if verify:
+            print("\t Known camera files changed, checking all of them")
+    if verify and known:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            infos = pool.map(lambda u: fileInfo(session, u, apiURL), known)
+            needed.extend(url for url, info in zip(known, infos) if _changed(info, manifest[url]))
+    return needed
+
+
+def syncFolder(session, localDir, cameraDir=None, apiURL=API_URL, verify=False,
+               workers=SYNC_WORKERS, onSaved=None):
+    """ Download new or changed files of a camera folder into localDir
+
+    Inputs:
+       session - Session object currently connected to camera
+       localDir - local folder, created if needed
+       cameraDir - CCAPI folder path, the camera's current folder if None
+       verify - also re-check files already in the manifest (see diffFolder)
+       workers - concurrent requests for listing and downloading
+       onSaved - optional function called with the full local path of each saved file
+
+    Returns:
+       result - dictionary with the number of files listed, downloaded, failed
+                and already up to date
+    """
+    if cameraDir is None:
+        cameraDir = getCurrentDir(session, apiURL)[1]
+        if not cameraDir:
+            raise ConnectionError("syncFolder: no media mounted in the camera")
+    os.makedirs(localDir, exist_ok=True)
+    manifest = loadManifest(localDir)
+    urls = listFolder(session, cameraDir, apiURL, workers)
+    needed = diffFolder(session, urls, manifest, localDir, apiURL, verify, workers)
+    print("\t {} files on camera, {} to download".format(len(urls), len(needed)))
+
+    def download(url):
+        try:
+            return url, downloadFile(session, url, localDir, apiURL, onSaved)
+        except Exception as e:
+            # one bad file must not end the sync
+            print("\t syncFolder: could not download {}: {}".format(url, e))
+            return url, None
+
+    failed = 0
+    with span("syncFolder", "transfer", count=len(needed)):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for n, (url, saved) in enumerate(pool.map(download, needed), 1):
+                if saved is not None:
+                    fName, info = saved
+                    manifest[url] = dict(info, local=fName,
+                                         localSize=os.path.getsize(os.path.join(localDir, fName)))
+                else:
+                    failed += 1
+                if n % MANIFEST_EVERY == 0:
+                    writeManifest(localDir, manifest)
+    writeManifest(localDir, manifest)
+    return {"listed": len(urls), "downloaded": len(needed) - failed, "failed": failed,
+            "upToDate": len(urls) - len(needed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy new camera files to a local folder")
+    parser.add_argument("localDir", help="local folder to bring up to date")
+    parser.add_argument("--camera-dir", help="CCAPI folder path, default is the current folder")
+    parser.add_argument("--verify", action="store_true",
+                        help="also check the size and date of files already copied")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS)
+    args = parser.parse_args()
+
+    r5Session, camReady = createR5Session()
+    if not camReady:
+        raise SystemExit("\t Camera is not connected")
+    try:
+        result = syncFolder(r5Session, args.localDir, args.camera_dir,
+                            verify=args.verify, workers=args.workers)
+        print("\t Synced: {downloaded} downloaded, {upToDate} up to date, "
+              "{failed} failed".format(**result))
+    finally:
+        r5Session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+""" frameCache.py
+    agent 19Oct2026
+
+    Decode each captured image once and keep the pixels on disk.
+
+    Decoding a 45MP JPEG costs far more than reading the pixels back, and
+    every analysis pass (QA, alignment, stacking, re-stacking) would decode
+    the same files again. Decoded frames and their pyramid levels are stored
+    as .npy files named by a hash of the image file contents, so a renamed
+    or copied image still hits the cache. Later passes open them with
+    numpy's mmap_mode which costs almost nothing until pixels are touched.
+
+    The cache directory is capped in size. Every hit refreshes the file's
+    modification time and the least recently used files are removed first.
+
+    Note:
+    1) Decoding uses Pillow, so CR3 raw files are not supported. Shoot
+       JPEG (or RAW+JPEG) for anything that should be cached.
+"""
+import os
+import hashlib
+import numpy as np
+from PIL import Image
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "macroPhotoShooter", "frames")
+CACHE_MAX_BYTES = 20 * 1024**3  # 20GB holds ~150 full size 45MP RGB frames
+PYRAMID_LEVELS = 4  # level 0 is full size, each level after is half the size
+HASH_CHUNK = 1024 * 1024
+
+_digests = {}  # (path, size, mtime) -> digest, saves re-hashing within a process
+
+
+def fileDigest(imagePath):
+    """ Content hash of an image file, used as the cache key
+    """
+    stat = os.stat(imagePath)
+    statKey = (os.path.abspath(imagePath), stat.st_size, stat.st_mtime_ns)
+    if statKey in _digests:
+        return _digests[statKey]
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(imagePath, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    _digests[statKey] = digest.hexdigest()
+    return _digests[statKey]
+
+
+def _levelPath(digest, level, cacheDir):
+    return os.path.join(cacheDir, "{}_L{}.npy".format(digest, level))
+
+
+def _halfSize(frame):
+    """ Next pyramid level, mean of each 2x2 block
+    """
+    h = frame.shape[0] // 2
+    w = frame.shape[1] // 2
+    blocks = frame[: h * 2, : w * 2].reshape((h, 2, w, 2) + frame.shape[2:])
+    return blocks.mean(axis=(1, 3)).round().astype(frame.dtype)
+
+
+def _saveNpy(path, array):
+    # write to a temporary name first so readers never see a partial file
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        np.save(f, array)
+    os.replace(tmpPath, path)
+
+
+def decodeImage(imagePath):
+    """ Decode an image file into a (height, width, 3) uint8 array
+    """
+    if imagePath.upper().endswith(".CR3"):
+        raise ValueError("frameCache: CR3 files can not be decoded " + imagePath)
+    with Image.open(imagePath) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+def cacheFrame(imagePath, levels=PYRAMID_LEVELS, cacheDir=CACHE_DIR,
+               maxBytes=CACHE_MAX_BYTES):
+    """ Decode an image into the cache unless it is already there
+
+    Intended as the onSaved callback of saveImageLocal()/copyFiles() so each
+    frame is decoded right after it is transferred.
+
+    Inputs:
+       imagePath - local image file
+       levels - number of pyramid levels to store
+       cacheDir - cache directory, created if needed
+       maxBytes - size cap of cacheDir
+
+    Returns:
+       digest - cache key of the image
+    """
+    os.makedirs(cacheDir, exist_ok=True)
+    digest = fileDigest(imagePath)
+    paths = [_levelPath(digest, level, cacheDir) for level in range(levels)]
+    if all(os.path.exists(path) for path in paths):
+        _touch(paths)
+        return digest
+
+    frame = decodeImage(imagePath)
+    for path in paths:
+        _saveNpy(path, frame)
+        frame = _halfSize(frame)
+    evictFrames(cacheDir, maxBytes, keep=paths)
+    return digest
+
+
+def loadFrame(imagePath, level=0, cacheDir=CACHE_DIR, maxBytes=CACHE_MAX_BYTES):
+    """ Memory-mapped, read-only pixels of an image at a pyramid level
+
+    The image is decoded and cached first if needed.
+    """
+    return np.load(framePath(imagePath, level, cacheDir, maxBytes), mmap_mode="r")
+
+
+def framePath(imagePath, level=0, cacheDir=CACHE_DIR, maxBytes=CACHE_MAX_BYTES):
+    """ Path of the cached .npy file of an image at a pyramid level
+
+    Useful for handing frames to other processes, i.e.
+    tileScheduler.stackNpyFiles([framePath(p) for p in images])
+    """
+    digest = cacheFrame(imagePath, max(level + 1, PYRAMID_LEVELS), cacheDir, maxBytes)
+    return _levelPath(digest, level, cacheDir)
+
+
+def _touch(paths):
+    for path in paths:
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+
+
+def evictFrames(cacheDir=CACHE_DIR, maxBytes=CACHE_MAX_BYTES, keep=()):
+    """ Delete least recently used files until the cache fits in maxBytes
+
+    Inputs:
+       keep - paths that must not be removed (i.e. the frame just added)
+
+    Returns:
+       removed - number of files deleted
+    """
+    entries = []
+    total = 0
+    with os.scandir(cacheDir) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".npy"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+    removed = 0
+    keep = set(keep)
+    for mtime, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except FileNotFoundError:
+            pass  # another process got to it first
+    return removed
+
+
+def main():
+    import sys
+    import tempfile
+    import time
+
+    cacheDir = tempfile.mkdtemp()
+    imagePath = sys.argv[1] if len(sys.argv) > 1 else None
+    if imagePath is None:
+        imagePath = os.path.join(cacheDir, "test.jpg")
+        Image.fromarray(
+            np.random.default_rng(0).integers(0, 255, (1200, 1800, 3), dtype=np.uint8)
+        ).save(imagePath)
+
+    # test_1 - first access decodes, second is a memory map of the cached file
+    start = time.perf_counter()
+    cacheFrame(imagePath, cacheDir=cacheDir)
+    decodeTime = time.perf_counter() - start
+    start = time.perf_counter()
+    frame = loadFrame(imagePath, cacheDir=cacheDir)
+    loadTime = time.perf_counter() - start
+    print("test_1: decode={:.4f}s  cached open={:.4f}s  shape={}".format(
+        decodeTime, loadTime, frame.shape))
+
+    # test_2 - pyramid level sizes
+    for level in range(PYRAMID_LEVELS):
+        print("test_2: level", level, loadFrame(imagePath, level, cacheDir).shape)
+
+    # test_3 - eviction down to the size of one full frame
+    print("test_3: removed", evictFrames(cacheDir, maxBytes=frame.nbytes), "files")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,31 +4,43 @@
    GCodes are buffered so you must insert M400 MCode to force controller to
    complete current command in buffer before accepting next command.
 """
-import serial
 import time, math
+from traceUtils import span
+from metricsUtils import observe
 
-def sendGCodeCmd(ser, command):
+PRINTER_PORT = "/dev/ttyUSB0"
+PRINTER_BAUD = 256000  # Mega I3 Marlin FW v1.1.9
+CMD_DELAY = 0.4  # seconds waited after writing each command
+
+def sendGCodeCmd(ser, command, delay=CMD_DELAY):
     cmdResponse = ""
     print("\t Sending GCode command: ", command.strip("\r\n"))
-    ser.write(str.encode(command))  # serial write is a blocking command
-    time.sleep(0.4)
-
-    while True:
-        line = ser.readline()
-        print("\t cmd resp: ", line)
-        if not line == b"ok\n":
-            cmdResponse = line
-        elif line == b"ok\n":
-            # there is room in buffer for another command
-            break
+    start = time.perf_counter()
+    with span(command.split()[0], "serial", cmd=command.strip("\r\n")):
+        ser.write(str.encode(command))  # serial write is a blocking command
+        if delay:
+            time.sleep(delay)
+
+        while True:
+            line = ser.readline()
+            print("\t cmd resp: ", line)
+            if not line == b"ok\n":
+                cmdResponse = line
+            elif line == b"ok\n":
+                # there is room in buffer for another command
+                break
+    observe("mps_serial_command_seconds", time.perf_counter() - start, cmd=command.split()[0])
 
     return cmdResponse
 
 
-def connect3dPrinter():
-    serialConn = serial.Serial("/dev/ttyUSB0", 256000)  # Mega I3 Marlin FW v1.1.9
+def connect3dPrinter(port=PRINTER_PORT, baudRate=PRINTER_BAUD, quiet=False):
+    import serial  # imported here so programs start without waiting on pyserial
+
+    serialConn = serial.Serial(port, baudRate)
     time.sleep(5)  # let printer board do its thing
-    print("\t serial port is open: ", serialConn.is_open)
+    if not quiet:
+        print("\t serial port is open: ", serialConn.is_open)
     # return serialConn, serialConn.isOpen()
     return serialConn, serialConn.is_open
 
@@ -63,7 +75,13 @@ def quickMove(serConn, x=math.nan, y=math.nan, z=math.nan):
     sendGCodeCmd(serConn, "M400\r\n")  # wait for buffered command to finish
 
 
-def slowMove(serConn, x=math.nan, y=math.nan, z=math.nan, feedRate=120):
+def slowMove(serConn, x=math.nan, y=math.nan, z=math.nan, feedRate=120, settle=None):
+    """ Move at feedRate (mm/min) and wait for the move to finish
+
+    settle - None keeps the fixed CMD_DELAY after each command. Otherwise the
+             commands are sent without it and the bed is given settle seconds
+             to stop vibrating once M400 reports the move done (see settleModel.py)
+    """
     cmd = "G0 "
     if not math.isnan(x):
         cmd = "%s X%s " % (cmd, x)
@@ -72,8 +90,13 @@ def slowMove(serConn, x=math.nan, y=math.nan, z=math.nan, feedRate=120):
     if not math.isnan(z):
         cmd = "%s Z%s " % (cmd, z)
     cmd = "%s F%s\r\n" % (cmd, feedRate)
-    sendGCodeCmd(serConn, cmd)  #
-    sendGCodeCmd(serConn, "M400\r\n")  # wait for buffered command to finish
+    delay = CMD_DELAY if settle is None else 0
+    with span("slowMove", "motion"):
+        sendGCodeCmd(serConn, cmd, delay)  #
+        sendGCodeCmd(serConn, "M400\r\n", delay)  # wait for buffered command to finish
+        if settle:
+            with span("settle", "motion", sec=settle):
+                time.sleep(settle)
 
 
 def getBedPositon(serConn):
@@ -17,22 +17,28 @@
     Note:
     1) Camera shutter setting should be set to single shot mode, otherwise the
        time between sending the shutter Press and Release commands allows
-       multiple pictures to be taken instead  of only one.
+       multiple pictures to be taken instead  of only one. Batch jobs can
+       set it with a camera profile (see cameraSettings.py).
 
 """
 # import os
 # import subprocess
+import os
 import sys
 import time
+import threading
 from datetime import datetime
 from r5_cameraUtils import (
+    API_URL,
     createR5Session,
     depthOfField,
-    stackingDOF,
+    stackingPositions,
     getLastEvent,
     shootR5Image,
     copyFiles,
     reportBatteryStatus,
+    preflightCheck,
+    printPreflight,
 )
 from gcodeUtils import (
     connect3dPrinter,
@@ -42,28 +48,73 @@ from gcodeUtils import (
     quickMove,
     slowMove,
     setOrigin,
-    gotoOrigin,
     printBedPosition,
     moveAxisZ,
 )
 
+from sessionJournal import (
+    SessionJournal,
+    newJournalPath,
+    readJournal,
+    latestIncomplete,
+)
+
+from cameraSettings import bracketOrder
+from settleModel import loadSettle
+from traceUtils import span
+from metricsUtils import inc, setGauge, observe
+
 # Globals
 prtConn = None  # serial object used to communicate with printer
-prtReady = False  # has connection to printer been established and bed configured
+prtReady = False  # has connection to printer been established
+prtHomed = False  # printer homed and bed configured by setupPrinter
+prtError = None  # why the background printer connection failed
 r5Session = None  # Request.Session object used to communicate with camera
 camReady = (
     False
 )  # camera has its CCAPI endpoint enabled and initial connection established
+prtThread = None  # background printer connection started at launch
+camThread = None  # background camera connection started at launch
+_frameCache = None  # frameCache module once imported, False if numpy/Pillow missing
+FRAME_CACHE = bool(os.environ.get("MPS_FRAME_CACHE"))  # decode copies into the frame cache
+PIPELINE = os.environ.get("MPS_PIPELINE")  # stages run on copies, see postPipeline.py
 fStop = 0.0  # camera FStop for image capture
 focalLen = 100  # focal length of camera lens - my default macro lens is 100mm
 subjectDist = 0  # distance from subject to camera focal plane
 subjectLen = 0  # length of subject capture
 dof = 0.0  # calculated Depth of Field
-bedMoveIncrement = 0.0  # calculated Y-axis movement between image captures
+slicePositions = []  # calculated Y-axis position of each image capture
 numShots = 0  # calculated number of shots required for subject capture
 shotDirection = 1 # default direction is Front to Back. -1 for Back to Front
+BED_START_Y = 110  # Y position of bed used as the shot origin
+
+def cacheFrame(localPath):
+    """ Decode a copied frame into the frame cache (see frameCache.py)
+
+    frameCache needs numpy and Pillow, which are slow to import, so they are
+    only loaded when the first file is copied. Skipped if they are not installed.
+    Decoding a full size frame takes a while and the cache may grow to 20GB,
+    so copies only call this when asked to (see savedHook).
+    """
+    global _frameCache
+    if _frameCache is None:
+        try:
+            import frameCache
+            _frameCache = frameCache
+        except ImportError:
+            _frameCache = False
+    if _frameCache:
+        _frameCache.cacheFrame(localPath)
+
+
+def savedHook():
+    """ onSaved function for the menu's copies: cacheFrame when the
+    MPS_FRAME_CACHE environment variable is set, otherwise None
+    """
+    return cacheFrame if FRAME_CACHE else None
+
 
-def setupPrinter(prtConn=None, homePrt=True, yAxis=110):
+def setupPrinter(prtConn=None, homePrt=True, yAxis=BED_START_Y, zMove=None):
     """ Send 3D-printer to known location and move Z axis rail out of way
 
     Send printer to the known home of machine (this uses machine's limit switches).
@@ -77,6 +128,8 @@ def setupPrinter(prtConn=None, homePrt=True, yAxis=110):
       prtConn: serial port object connected to 3D-Printer
       homePrt: send the X,Y,Z axis to mechanical home position
       yAxis: starting Y position of bed
+      zMove: mm to move the Z axis without prompting (0 leaves it alone).
+             If None the user is prompted
     """
     if homePrt:
         homePrinter(prtConn, True) # home X,Y but leave Z axis where it is
@@ -85,9 +138,12 @@ def setupPrinter(prtConn=None, homePrt=True, yAxis=110):
     quickMove(prtConn, x=0, y=yAxis)  # adjust bed and move zrail out of way
     setRelPositioning(prtConn)  # 91
     setOrigin(prtConn)  # sets x=0 y=0 z=staysAtCurrentValue
-    moveZ = input("\n\t Move Z axis out of way? y or (n): ")
-    if not moveZ == "" or not  moveZ.upper() == 'N':
-        moveAxisZ(prtConn)
+    if zMove is None:
+        moveZ = input("\n\t Move Z axis out of way? y or (n): ")
+        if not moveZ == "" or not  moveZ.upper() == 'N':
+            moveAxisZ(prtConn)
+    elif not zMove == 0:
+        slowMove(prtConn, z=zMove)  # still in relative positioning
 
 
 def getShotParams():
@@ -97,6 +153,9 @@ def getShotParams():
     returning the values collected. All parameters are globals, and are used as the
     default values for each prompt.
 
+    Entering 'p' for the FStop lets the shot planner pick the FStop needing the
+    fewest shots once the lens, distance and subject length are known.
+
     Globals updated:
       fStop - FStop setting of the camera
       focalLen - Focal length of lens (in mm)
@@ -105,8 +164,11 @@ def getShotParams():
     """
     global fStop, focalLen, subjectDist, subjectLen
     while True:
-        temp = input(f'\n\t Enter camera FStop (default={fStop}) : ')
-        if not temp == "":
+        planFStop = False
+        temp = input(f'\n\t Enter camera FStop (default={fStop}, p=plan it) : ')
+        if temp.upper() == "P":
+            planFStop = True
+        elif not temp == "":
             fStop = float(temp)
         temp = input(f'\t Enter lens focal length (default={focalLen}) : ')
         if not temp == "":
@@ -120,6 +182,20 @@ def getShotParams():
         if not temp == "":
             subjectLen = int(temp)
 
+        if planFStop:
+            from shotPlanner import planShots, printPlans  # needs numpy
+            plans = planShots(subjectLen, subjectDist, focalLens=(focalLen,),
+                              shotDirection=shotDirection)
+            printPlans(plans)
+            if plans:
+                fStop = plans[0]["fStop"]
+            else:
+                # nothing to plan with, the FStop must come from the user
+                temp = ""
+                while not temp:
+                    temp = input("\t No valid shot plan. Enter camera FStop : ")
+                fStop = float(temp)
+
         paramTxt = "\n\t FStop= {fStop} Lens_length = {fLen}mm distance_to_object = {sDist}mm subject_size = {sLen}mm"
         print(
             paramTxt.format(
@@ -133,11 +209,11 @@ def getShotParams():
             break
 
 
-def determineShotMovements(dof, objectLen):
-    stackingDepth = stackingDOF(dof)
-#    numShots = int(subjectLen / stackingDepth) + 4  # add extra. 2 before and 2 after
-    numShots = int(subjectLen / stackingDepth) + 2  # add extra. 2 after
-    return round(stackingDepth, 2), numShots
+def determineShotMovements(dist, objectLen):
+    # bed step varies with the distance of each slice. add extra. 2 after
+    positions = stackingPositions(dist, objectLen, fStop=fStop, focalLen=focalLen,
+                                  shotDirection=shotDirection)
+    return positions, len(positions)
 
 
 def decodeTime(seconds):
@@ -146,22 +222,89 @@ def decodeTime(seconds):
     return time.strftime("%H:%M:%S", ty_res)
 
 
-def printShotEstimate(bedMoveIncrement, numShots):
+def printShotEstimate(slicePositions):
+    numShots = len(slicePositions)
     timeGuess = round(numShots * 1.1, 0)  #
-    shotClockTxt = "\t Bed movement per shot = {bm}mm Number of shots = {ns}  estimated time (HH:MM:SS) = {et}"
+    steps = [round(b - a, 2) for a, b in zip([0.0] + slicePositions, slicePositions)]
+    shotClockTxt = "\t Bed movement per shot = {bmMin}-{bmMax}mm Number of shots = {ns}  estimated time (HH:MM:SS) = {et}"
     print("\n")
     print("++" * 50)
     print(
-        shotClockTxt.format(bm=bedMoveIncrement, ns=numShots, et=decodeTime(timeGuess))
+        shotClockTxt.format(
+            bmMin=min(steps, default=0), bmMax=max(steps, default=0),
+            ns=numShots, et=decodeTime(timeGuess)
+        )
     )
     print("++" * 50)
 
 
+def connectPrinterBackground():
+    """ Open the printer connection, run on prtThread
+
+    Nothing is moved and nothing is printed over the menu. The printer is
+    homed by homeIfNeeded() once the user asks for it
+    """
+    global prtConn, prtReady, prtError
+    try:
+        prtConn, prtReady = connect3dPrinter(quiet=True)
+    except Exception as e:
+        prtError = str(e)  # shown by Printer Status
+
+
+def homeIfNeeded():
+    """ Offer to home and set up a printer connected in the background
+
+    Returns:
+       prtHomed - True once the bed is at its origin
+    """
+    global prtHomed
+    if prtConn is not None and not prtHomed:
+        resp = input("\t Printer is connected but not homed. Home and set up the bed now? (y) or n: ")
+        if resp == "" or "Y" == resp.upper():
+            setupPrinter(prtConn)
+            prtHomed = True
+    return prtHomed
+
+
+def connectCameraBackground():
+    """ Open the camera session, run on camThread
+    """
+    global r5Session, camReady
+    r5Session, camReady = createR5Session()
+
+
+def startBackgroundConnect():
+    """ Connect printer and camera at the same time while the menu is up
+    """
+    global prtThread, camThread
+    prtThread = threading.Thread(target=connectPrinterBackground, daemon=True)
+    camThread = threading.Thread(target=connectCameraBackground, daemon=True)
+    prtThread.start()
+    camThread.start()
+
+
+def connectionStatus(thread, ready):
+    if thread is not None and thread.is_alive():
+        return "connecting..."
+    return ready
+
+
+def waitForConnect(thread, label):
+    if thread is not None and thread.is_alive():
+        print("\t Waiting for {} connection to finish ...".format(label))
+        thread.join()
+
+
 def printMenu():
     menuStatusTxt = "\t Printer Connected: {prtStat} \t  Camera Connected: {camStat}\n"
     menuOptionTxt = "\t {optNum}  --- {opt}"
     print("\n\n\t\t Macro Photo Shooter Main Menu \n")
-    print(menuStatusTxt.format(prtStat=prtReady, camStat=camReady))
+    print(
+        menuStatusTxt.format(
+            prtStat=connectionStatus(prtThread, prtReady),
+            camStat=connectionStatus(camThread, camReady),
+        )
+    )
     for key in menuOptionDict.keys():
         print(menuOptionTxt.format(optNum=key, opt=menuOptionDict[key]))
 
@@ -170,16 +313,21 @@ def printMenu():
 def checkPrinterStatus():
     try:
         # show if printer is connected and current X, Y,Z coordinates
-        global prtConn, prtReady
+        global prtConn, prtReady, prtHomed
         print("\tcheckPrinterStatus")
+        waitForConnect(prtThread, "printer")
         if prtConn is None:
+            if prtError is not None:
+                print("\t Printer connection failed: ", prtError)
             resp = input("\tPrinter is not connected: Retry connection (y) or n: ")
             if resp == "" or "Y" == resp.upper():
                 prtConn, success = connect3dPrinter()
                 if success:
                     print("\t Printer connection established")
                     setupPrinter(prtConn)
-                    prtReady = True
+                    prtReady = prtHomed = True
+        else:
+            homeIfNeeded()
     except Exception as e:
         print("\n\t Exception detected: ", e)
 
@@ -200,6 +348,7 @@ def checkPrinterStatus():
 def checkCameraStatus():
     global r5Session, camReady
     print("\tcheckCameraStatus")
+    waitForConnect(camThread, "camera")
     if r5Session is None:
         resp = input("\tCamera is not connected: Retry connection (y) or n: ")
         if resp == "" or "Y" == resp.upper():
@@ -224,17 +373,17 @@ def checkCameraStatus():
 
 
 def defineShotParameters():
-    global dof, bedMoveIncrement, numShots
+    global dof, slicePositions, numShots
 
     print("\n\t --- Define Shot Parameters ---")
     while True:
         try:
             getShotParams()
             dof = depthOfField(dist=subjectDist, fStop=fStop, focalLen=focalLen)
-            bedMoveIncrement, numShots = determineShotMovements(dof, subjectLen)
+            slicePositions, numShots = determineShotMovements(subjectDist, subjectLen)
 
             # tell user about time info for these shots
-            printShotEstimate( bedMoveIncrement, numShots )
+            printShotEstimate( slicePositions )
 
             ready = input("\n\t Happy with Shot Parameters? (y) or n: ")
             if ready == "" or "Y" == ready.upper():
@@ -248,11 +397,15 @@ def defineShotParameters():
 
 
 def checkShotEndpoints():
-    global shotDirection, prtConn, bedMoveIncrement, numShots
+    global shotDirection, prtConn, slicePositions, numShots
     print("\n\t --- Check Shot Endpoints ---\n")
     print("\t Allows photographer to check the lighting and composition of the")
     print("\t subject at the begining and end of the shooting distances as")
     print("\t specified by the Define Shot Parameters menu option. \n")
+    waitForConnect(prtThread, "printer")
+    if not homeIfNeeded():
+        print("\t Printer must be connected and homed first (option 1)")
+        return
 
     while True:
         if shotDirection > 0:
@@ -266,6 +419,9 @@ def checkShotEndpoints():
             break
 
         shotDirection *= -1 # change direction and prompt again to verify
+        if slicePositions:
+            # steps depend on which end of the subject the stack starts from
+            slicePositions, numShots = determineShotMovements(subjectDist, subjectLen)
 
     # cycle printer bed through endpoints until everyone is happy
     setRelPositioning(prtConn)  # 91
@@ -282,40 +438,244 @@ def checkShotEndpoints():
             break
 
         # compute and head to next endpoint location
-        ypos = round(bedMoveIncrement * numShots * endptLocation, 2)
+        endY = slicePositions[-1] if slicePositions else 0
+        ypos = round(endY * endptLocation, 2)
         slowMove(prtConn, y=ypos)
         endptLocation *= -1
 
 
+def captureStack(prtConn, r5Session, slicePositions, shotDirection, apiURL=API_URL,
+                 onShot=None, journal=None, startIndex=0, stopIndex=None,
+                 settings=None, brackets=None, settleModel=None, onFiles=None):
+    """ Loop through bed moves and image captures for one stack
+
+    Bed must already be at the shot's starting position (the origin).
+
+    Args:
+      prtConn: serial port object connected to 3D-Printer
+      r5Session: Request.Session object connected to camera
+      slicePositions: Y position of each shot, relative to the start
+      shotDirection: 1 for Front to Back, -1 for Back to Front
+      apiURL: domain and port URL of camera
+      onShot: optional function called after each shot as onShot(shotNum, y)
+      journal: optional SessionJournal recording each slice and the camera
+               files, which are polled once per journal batch
+      startIndex: first slice to shoot. The bed moves straight from the origin
+               to that slice, used when resuming a session
+      stopIndex: slice to stop before, None shoots to the end. The journal
+               is only marked complete when the last slice is shot. A slice
+               whose shutter release failed ends the stack early and is not
+               journaled, so resuming shoots it again
+      settings: optional cameraSettings.SettingsCache, kept up to date from the
+               events polled here
+      brackets: optional list of settings dictionaries, one frame is shot with
+               each at every slice (needs settings). Events are then polled
+               after every slice, so a dial turned on the camera mid-stack
+               reaches the cache before the next slice's frames
+      settleModel: optional settleModel.SettleModel of the rig. Each move then
+               waits its calibrated dwell instead of the fixed command delays
+      onFiles: optional function called with each batch of new camera files
+               in shooting order (see postPipeline.CopyFeed). Events are then
+               polled after every slice, so files can be copied mid-stack
+
+    Returns:
+      addedList - CCAPI resource paths of the images captured
+      elapsed - timedelta of the shot sequence
+      endY - bed Y reached, measured like slicePositions. Less than the last
+             position when the stack stopped early, so move back by this
+    """
+    # move printer to start positioning and clear camera polling buffer
+    # start before subject
+#    slowMove(prtConn, y=-round(bedMoveIncrement * 3 * shotDirection, 2))
+    slowMove(prtConn, y=0)
+    setRelPositioning(prtConn)  # 91
+    result = getLastEvent(r5Session, apiURL)  # clear polling buffer in camera
+    if settings is not None:
+        settings.applyEvent(result)
+    addedList = []
+    if startIndex > 0:
+        # resuming, images shot since the last journal batch are still buffered
+        addedList.extend(result.get("addedcontents") or [])
+        if journal is not None:
+            journal.recordFiles(result.get("addedcontents"), startIndex - 1)
+        if onFiles is not None and result.get("addedcontents"):
+            onFiles(result["addedcontents"])
+
+    if stopIndex is None:
+        stopIndex = len(slicePositions)
+    startTime = datetime.now()
+    prevY = 0.0  # bed Y, the origin until the first move
+    lastShot = stopIndex - 1  # last slice that was shot
+    setGauge("mps_shots_remaining", stopIndex - startIndex)
+    for shotNum in range(startIndex, stopIndex):
+        y = slicePositions[shotNum]
+        shotStart = time.perf_counter()
+        with span("shot", "shot", n=shotNum, y=y):
+            dy = round((y - prevY) * shotDirection, 2)
+            slowMove(prtConn, y=dy,
+                     settle=None if settleModel is None else settleModel.dwell(dy))
+            prevY = y
+            shot = True
+            if brackets:
+                for frame in bracketOrder(brackets, shotNum):
+                    settings.apply(frame)  # only what differs from the last frame
+                    shot = shootR5Image(session=r5Session, apiURL=apiURL, af=False) and shot
+            else:
+                shot = shootR5Image(session=r5Session, apiURL=apiURL, af=False)
+            if not shot:
+                print("\t Slice {} was not captured, stopping the stack".format(shotNum))
+                lastShot = shotNum - 1
+                break
+            if onShot is not None:
+                onShot(shotNum, y)
+            poll = bool(brackets) or onFiles is not None
+            if journal is not None:
+                journal.recordSlice(shotNum, y)
+                poll = poll or (shotNum + 1) % journal.batchSize == 0
+            if poll:
+                result = getLastEvent(r5Session, apiURL)
+                if settings is not None:
+                    settings.applyEvent(result)
+                addedList.extend(result.get("addedcontents") or [])
+                if journal is not None:
+                    journal.recordFiles(result.get("addedcontents"), shotNum)
+                if onFiles is not None and result.get("addedcontents"):
+                    onFiles(result["addedcontents"])
+        observe("mps_shot_seconds", time.perf_counter() - shotStart)
+        inc("mps_shots_total")
+        setGauge("mps_shots_remaining", stopIndex - shotNum - 1)
+    stopTime = datetime.now()
+
+    result = getLastEvent(r5Session, apiURL)  # get all events from polling buffer
+    if settings is not None:
+        settings.applyEvent(result)
+    added = result.get("addedcontents") or []  # only care about image(s) added
+    addedList.extend(added)
+    if onFiles is not None and added:
+        onFiles(added)
+    if journal is not None:
+        journal.recordFiles(added, lastShot)
+        if lastShot >= len(slicePositions) - 1:
+            journal.complete()
+    return addedList, stopTime - startTime, prevY
+
+
+def preflightShots(r5Session, numShots):
+    """ Ask the camera if it can take numShots before anything moves
+
+    Returns:
+      shots - number of shots to take now. Less than numShots when the user
+              agreed to split the job, 0 when it is refused
+    """
+    report = preflightCheck(r5Session, numShots)
+    printPreflight(report)
+    if report["action"] == "ok":
+        return numShots
+    if report["action"] == "split":
+        resp = input("\t Shoot the first {} slices now and resume the rest after "
+                     "swapping? (y) or n: ".format(report["maxShots"]))
+        if resp == "" or "Y" == resp.upper():
+            return report["maxShots"]
+    print("\t ...Shoot not started")
+    return 0
+
+
+def copyJournaled(r5Session, addedList, journal, params=None, resume=False, shotNums=None):
+    """ Prompted copy of images, each download is recorded in the journal
+
+    Previews are not journaled, their originals are still waiting on the camera.
+    Packing writes the images and shot parameters into one .stack file. When
+    resuming, an existing pack of the session is appended to, shotNums then
+    holds each image's place in the session so it is packed with its slice.
+    Copies go through the MPS_PIPELINE stages when it is set.
+    """
+    cache = savedHook()
+
+    def onSaved(localPath):
+        if cache is not None:
+            cache(localPath)
+        journal.recordDownload(localPath)
+
+    cf = input("\n\t Copy files from camera to local directory?  (y), n, p (previews only)"
+               " or k (pack into one file): ")
+    if cf == "" or "Y" == cf.upper():
+        pipeline = None
+        if PIPELINE:
+            from postPipeline import Pipeline, buildStages, parseSpec
+
+            try:
+                pipeline = Pipeline(buildStages(parseSpec(PIPELINE)), slicePositions, params)
+            except ValueError as e:
+                print("\t MPS_PIPELINE not used: ", e)
+
+        def onCopied(localPath, n):
+            onSaved(localPath)  # journaled under the camera's name, before any rename
+            if pipeline is not None:
+                pipeline.onSaved(localPath, n if shotNums is None else shotNums[n])
+
+        copyFiles(r5Session, addedList, onSaved=onCopied, numbered=True)
+        if pipeline is not None:
+            done = pipeline.close()
+            print("\t {} images through the pipeline, {} errors".format(
+                len(done), len(pipeline.errors)))
+    elif "P" == cf.upper():
+        from previewTransfer import copyPreviews
+
+        dirName = input("\t Enter a directory name to create: ")
+        copyPreviews(r5Session, addedList, dirName)
+        print("\t Fetch originals later with: python previewTransfer.py {} [names]".format(
+            dirName or "."))
+    elif "K" == cf.upper():
+        from stackContainer import packFiles
+
+        while True:
+            packPath = input("\t Enter a file name for the pack: ")
+            if not packPath.endswith(".stack"):
+                packPath += ".stack"
+            if resume or not os.path.exists(packPath):
+                break
+            print("\t {} holds another session, pick another name".format(packPath))
+        packFiles(r5Session, addedList, packPath, slicePositions, params,
+                  onPacked=journal.recordDownload,
+                  capacity=max(len(addedList), len(slicePositions)), resume=resume,
+                  shotNums=shotNums)
+    else:
+        print(" \t...Files requested not to be copied locally")
+    journal.close()
+
+
 def performShotCaptures():
-    global shotDirection, prtConn, r5Session,bedMoveIncrement, numShots
+    global shotDirection, prtConn, r5Session, slicePositions
     print("\n\t --- Perform Shot Captures ---\n")
-    if prtReady and camReady:
-        # move printer to start positioning and clear camera polling buffer
-         # start before subject
-#        slowMove(prtConn, y=-round(bedMoveIncrement * 3 * shotDirection, 2))
-        slowMove(prtConn, y=0)
-        setRelPositioning(prtConn)  # 91
-        result = getLastEvent(r5Session)  # clear polling buffer in camera
-
-        startTime = datetime.now()
-        for x in range(numShots):
-            slowMove(prtConn, y=bedMoveIncrement * shotDirection)
-            shootR5Image(session=r5Session, af=False)
+    waitForConnect(prtThread, "printer")
+    waitForConnect(camThread, "camera")
+    shotsNow = 0
+    if prtReady and camReady and not homeIfNeeded():
+        print("\t ...Shoot not started, the printer is not homed")
+    elif prtReady and camReady:
+        shotsNow = preflightShots(r5Session, len(slicePositions))
+    if shotsNow > 0:
+        journal = SessionJournal(newJournalPath())
+        journal.start(slicePositions, shotDirection, BED_START_Y, {
+            "fStop": fStop, "focalLen": focalLen,
+            "subjectDist": subjectDist, "subjectLen": subjectLen})
+        addedList, elapsed, _ = captureStack(
+            prtConn, r5Session, slicePositions, shotDirection, journal=journal,
+            stopIndex=shotsNow, settleModel=loadSettle()
+        )
+        if shotsNow < len(slicePositions):
+            print("\n\t Split shoot: swap battery/card then use Resume Session")
 
         # final positon in Y-axis should be ~subject length
         printBedPosition( prtConn )
-        stopTime = datetime.now()
         print("\n\t ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++")
-        print("\t    shot sequence completed. Elapsed time = ", (stopTime - startTime))
+        print("\t    shot sequence completed. Elapsed time = ", elapsed)
         paramTxt = "\n\tFStop= {fStop} Lens_length = {fLen}mm distance_to_object = {sDist}mm subject_size = {sLen}mm"
         print(paramTxt.format(fStop=fStop, fLen=focalLen, sDist=subjectDist, sLen=subjectLen))
         # tell user about time info for these shots
-        printShotEstimate( bedMoveIncrement, numShots )
+        printShotEstimate( slicePositions )
 
         # report image file names that were captured
-        result = getLastEvent(r5Session)  # get all events from polling buffer
-        addedList = result.get("addedcontents")  # only care about image(s) added
         print("\tImages captured:")
         for image in range(len(addedList)):
             print("\t\t", addedList[image])
@@ -323,12 +683,11 @@ def performShotCaptures():
         print("\n\t ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++")
 
         # see if files should be copied
-        cf = input("\n\t Copy files from camera to local directory?  (y) or n: ")
-        if cf == "" or "Y" == cf.upper():
-            copyFiles(r5Session, addedList)
-        else:
-            print(" \t...Files requested not to be copied locally")
-    else:
+        copyJournaled(r5Session, addedList, journal, {
+            "fStop": fStop, "focalLen": focalLen, "subjectDist": subjectDist,
+            "subjectLen": subjectLen, "shotDirection": shotDirection,
+            "elapsedSec": elapsed.total_seconds()})
+    elif not (prtReady and camReady):
         # Printer or Camera connectivity not established
         print("\n\t Error detected with connectivity as follows:")
         print("\t Printer connectivity established: ", prtReady)
@@ -336,10 +695,84 @@ def performShotCaptures():
 
     input("Press ENTER key to return to Main Menu ...")
 
+def resumeSession():
+    """ Finish the newest session that did not complete
+
+    The bed is re-homed to the same origin, moved straight to the first slice
+    that was not shot and the stack carries on from there. Camera files not yet
+    downloaded are offered for copying at the end.
+    """
+    global shotDirection, slicePositions, prtHomed
+    print("\n\t --- Resume Session ---\n")
+    waitForConnect(prtThread, "printer")
+    waitForConnect(camThread, "camera")
+    journalPath = latestIncomplete()
+    if journalPath is None:
+        print("\t No unfinished session found")
+    elif not (prtReady and camReady):
+        print("\t Printer connectivity established: ", prtReady)
+        print("\t Camera connectivity established:  ", camReady)
+    else:
+        state = readJournal(journalPath)
+        header = state["header"]
+        slicePositions = header["positions"]
+        shotDirection = header["shotDirection"]
+        print("\t Session {} stopped after slice {} of {}".format(
+            journalPath, state["nextSlice"], len(slicePositions)))
+        print("\t Shot parameters: ", header["params"])
+        resp = input("\t Resume this session? (y) or n: ")
+        shotsNow = 0
+        if resp == "" or "Y" == resp.upper():
+            shotsNow = preflightShots(r5Session, len(slicePositions) - state["nextSlice"])
+        if shotsNow > 0:
+            journal = SessionJournal(journalPath)
+            setupPrinter(prtConn, homePrt=True, yAxis=header["yAxis"], zMove=0)
+            prtHomed = True
+            addedList, elapsed, _ = captureStack(
+                prtConn, r5Session, slicePositions, shotDirection,
+                journal=journal, startIndex=state["nextSlice"],
+                stopIndex=state["nextSlice"] + shotsNow, settleModel=loadSettle()
+            )
+            print("\t Resumed shot sequence completed. Elapsed time = ", elapsed)
+            downloaded = {os.path.basename(p) for p in state["downloaded"]}
+            sessionFiles = state["files"] + addedList  # shooting order
+            shotNums = [n for n, f in enumerate(sessionFiles)
+                        if os.path.basename(f) not in downloaded]
+            pending = [sessionFiles[n] for n in shotNums]
+            print("\t\t images not yet copied = ", len(pending))
+            copyJournaled(r5Session, pending, journal, header["params"], resume=True,
+                          shotNums=shotNums)
+
+    input("Press ENTER key to return to Main Menu ...")
+
+
+def syncCameraFolder():
+    """ Copy the camera's current folder to a local folder, skipping files
+    already copied by an earlier sync
+    """
+    from cameraSync import syncFolder
+
+    print("\n\t --- Sync Camera Folder ---\n")
+    waitForConnect(camThread, "camera")
+    if not camReady:
+        print("\t Camera connectivity established:  ", camReady)
+    else:
+        dirName = input("\t Enter a local directory to sync into: ")
+        try:
+            result = syncFolder(r5Session, dirName or os.getcwd(), onSaved=savedHook())
+            print("\t Synced: {downloaded} downloaded, {upToDate} up to date, "
+                  "{failed} failed".format(**result))
+        except Exception as e:
+            print("\n\t Sync failed: ", e)
+
+    input("Press ENTER key to return to Main Menu ...")
+
+
 def printBedLocation():
     # show if printer is connected and current X, Y,Z coordinates
     global prtConn
     print("\tPrint Bed Location")
+    waitForConnect(prtThread, "printer")
     if prtConn is None:
         print("\tPrinter is not connected... ")
     else:
@@ -351,11 +784,11 @@ def printBedLocation():
 
 def changeZAxis():
     global prtConn
+    waitForConnect(prtThread, "printer")
     moveAxisZ(prtConn)
 
 
 
-# main
 menuOptionDict = {
     1: "Printer Status",
     2: "Camera Status",
@@ -364,47 +797,61 @@ menuOptionDict = {
     5: "Perform Shot Captures",
     6: "Print Bed Location",
     7: "Change Z-axis",
-    8: "Exit",
+    8: "Resume Session",
+    9: "Sync Camera Folder",
+    10: "Exit",
 }
 
-try:
-    print("\n Starting to connect to printer and camera...\n")
 
-    while True:
-        printMenu()
-        selOption = ""
-        try:
-            selOption = int(input("Enter menu option: "))
-        except:
-            print("Wrong input choice selected. Please enter a valid number ...")
-
-        if selOption == 1:
-            checkPrinterStatus()
-        elif selOption == 2:
-            checkCameraStatus()
-        elif selOption == 3:
-            defineShotParameters()
-        elif selOption == 4:
-            checkShotEndpoints()
-        elif selOption == 5:
-            performShotCaptures()
-        elif selOption == 6:
-            printBedLocation()
-        elif selOption == 7:
-            changeZAxis()
-        elif selOption == 8:
-            print("\n\t Exiting program ...\n")
-            sys.exit()
-        else:
-            print(
-                "\n\tInvalid option selected. Enter number between 1 and ",
-                len(menuOptionDict),
-            )
-
-
-except Exception as caughtEx:
-    print("-+" * 20)
-    print("Fatal exception detected")
-    print(caughtEx)
-    print("-+" * 20)
-    print("\n")
+# main
+def main():
+    try:
+        print("\n Starting to connect to printer and camera...\n")
+        startBackgroundConnect()
+
+        while True:
+            printMenu()
+            selOption = ""
+            try:
+                selOption = int(input("Enter menu option: "))
+            except:
+                print("Wrong input choice selected. Please enter a valid number ...")
+
+            if selOption == 1:
+                checkPrinterStatus()
+            elif selOption == 2:
+                checkCameraStatus()
+            elif selOption == 3:
+                defineShotParameters()
+            elif selOption == 4:
+                checkShotEndpoints()
+            elif selOption == 5:
+                performShotCaptures()
+            elif selOption == 6:
+                printBedLocation()
+            elif selOption == 7:
+                changeZAxis()
+            elif selOption == 8:
+                resumeSession()
+            elif selOption == 9:
+                syncCameraFolder()
+            elif selOption == 10:
+                print("\n\t Exiting program ...\n")
+                sys.exit()
+            else:
+                print(
+                    "\n\tInvalid option selected. Enter number between 1 and ",
+                    len(menuOptionDict),
+                )
+
+
+    except Exception as caughtEx:
+        print("-+" * 20)
+        print("Fatal exception detected")
+        print(caughtEx)
+        print("-+" * 20)
+        print("\n")
+
+
+if __name__ == "__main__":
+    main()
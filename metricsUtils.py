@@ -0,0 +1,182 @@
+""" metricsUtils.py
+    agent 19Oct2026
+
+    Live counters of a running rig, served for Prometheus.
+
+    Shots done and remaining, time per shot, camera busy retries, serial
+    command latency, bytes transferred and transfer queue depth are kept as
+    counters, gauges and histograms. Updating one is a dictionary update
+    under a lock, so the capture loop never waits on the server. Every value
+    carries a rig label, taken from the calling thread (see setRig), so the
+    rigs of rigOrchestrator.py are told apart on one dashboard.
+
+    Values are served in the Prometheus text format by a small HTTP server on
+    its own thread, i.e. http://localhost:9464/metrics. Turn it on with the
+    MPS_METRICS environment variable (or --metrics on batchRunner.py and
+    rigOrchestrator.py):
+       MPS_METRICS=9464 python macroPhotoShooter.py
+"""
+import os
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = 9464
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+METRIC_HELP = {
+    "mps_shots_total": ("counter", "Slices shot"),
+    "mps_shots_remaining": ("gauge", "Slices left in the current stack"),
+    "mps_shot_seconds": ("histogram", "Time per slice, bed move to shutter release"),
+    "mps_camera_busy_retries_total": ("counter", "Shutter presses the camera answered busy (503)"),
+    "mps_serial_command_seconds": ("histogram", "Serial G-code command round trip"),
+    "mps_transfer_bytes_total": ("counter", "Image bytes downloaded from the camera"),
+    "mps_transfer_seconds": ("histogram", "Time to download one image"),
+    "mps_transfer_queue_depth": ("gauge", "Images waiting for the transfer thread"),
+    "mps_pipeline_queue_depth": ("gauge", "Saved images waiting for a pipeline worker"),
+    "mps_pipeline_stage_seconds": ("histogram", "Time of one post-capture stage on one image"),
+}
+
+_lock = threading.Lock()
+_values = {}  # (name, labels) -> counter or gauge value
+_hists = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_local = threading.local()
+_server = None
+
+
+def setRig(rigName):
+    """ Label every value recorded by the calling thread with rigName
+    """
+    _local.rig = rigName
+
+
+def _labels(labels):
+    labels["rig"] = getattr(_local, "rig", "default")
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def setGauge(name, value, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _values[key] = value
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    n = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        hist = _hists.get(key)
+        if hist is None:
+            hist = _hists[key] = [0] * (len(BUCKETS) + 2)
+        hist[n] += 1
+        hist[-1] += seconds
+
+
+def _labelTxt(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for k, v in items)
+    return "{" + ",".join('{}="{}"'.format(k, v) for (k, _), v in zip(items, escaped)) + "}"
+
+
+def render():
+    """ Every metric in the Prometheus text exposition format
+    """
+    with _lock:
+        values = dict(_values)
+        hists = {key: list(hist) for key, hist in _hists.items()}
+
+    lines = []
+    names = sorted({name for name, _ in values} | {name for name, _ in hists})
+    for name in names:
+        kind, helpTxt = METRIC_HELP.get(name, ("untyped", name))
+        lines.append("# HELP {} {}".format(name, helpTxt))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for (metric, labels), value in sorted(values.items()):
+            if metric == name:
+                lines.append("{}{} {}".format(name, _labelTxt(labels), value))
+        for (metric, labels), hist in sorted(hists.items()):
+            if metric != name:
+                continue
+            total = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), hist[:-1]):
+                total += count
+                lines.append("{}_bucket{} {}".format(
+                    name, _labelTxt(labels, [("le", bound)]), total))
+            lines.append("{}_sum{} {}".format(name, _labelTxt(labels), round(hist[-1], 6)))
+            lines.append("{}_count{} {}".format(name, _labelTxt(labels), total))
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the console
+
+
+def startMetricsServer(port=METRICS_PORT, host="127.0.0.1"):
+    """ Serve /metrics on a daemon thread. Returns the server
+    """
+    global _server
+    if _server is None:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        thread = threading.Thread(target=_server.serve_forever, name="metrics", daemon=True)
+        thread.start()
+        print("\t Metrics at http://{}:{}/metrics".format(host, _server.server_address[1]))
+    return _server
+
+
+if os.environ.get("MPS_METRICS"):
+    startMetricsServer(int(os.environ["MPS_METRICS"]))
+
+
+def main():
+    import time
+    import urllib.request
+
+    # test_1 - two rigs recording from their own threads, scraped over HTTP
+    def rig(name, shots):
+        setRig(name)
+        for n in range(shots):
+            inc("mps_shots_total")
+            setGauge("mps_shots_remaining", shots - n - 1)
+            observe("mps_shot_seconds", 0.3 + n * 0.1)
+        observe("mps_serial_command_seconds", 0.02, cmd="G0")
+
+    threads = [threading.Thread(target=rig, args=(name, shots))
+               for name, shots in (("bench1", 3), ("bench2", 5))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    server = startMetricsServer(0)
+    url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+    print(urllib.request.urlopen(url).read().decode())
+
+    # test_2 - cost of one update
+    start = time.perf_counter()
+    for n in range(100000):
+        inc("mps_shots_total")
+    print("test_2: inc cost = {:.0f}ns".format((time.perf_counter() - start) * 1e4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+""" mosaicPlanner.py
+    agent 19Oct2026
+
+    Shoot a grid of focus stacks for subjects larger than one frame.
+
+    Tile positions across X (frame width) and Z (frame height) are computed
+    from the sensor field of view at the shooting distance, with overlap
+    for the panorama stitcher. Tiles are visited in a serpentine and every
+    other stack is shot in the opposite Y direction, so each stack starts
+    where the previous one ended and the bed never travels back empty. Both
+    serpentines (rows along X or columns along Z) are costed with the axis
+    feed rates and settle time, and the cheaper one is used.
+
+    The whole grid runs as one job and an index of tile -> slice files is
+    written next to the images.
+
+    Note:
+    1) X and Z move the print head carriage, not the bed. The camera (or the
+       subject) has to be mounted on the carriage for X/Z tiling to work.
+"""
+import os
+import json
+import math
+from r5_cameraUtils import (
+    API_URL,
+    copyFiles,
+)
+from gcodeUtils import slowMove
+from previewTransfer import copyPreviews
+from stackContainer import packFiles
+
+R5_SENSOR = (36.0, 24.0)  # sensor width, height in mm
+X_FEED = 1200  # mm/min for tile moves along X
+Z_FEED = 300  # mm/min for tile moves along Z, the Z screw is much slower
+TILE_SETTLE = 0.5  # seconds to let the rig settle after a tile move
+INDEX_NAME = "mosaic_index.json"
+
+
+def fieldOfView(dist, focalLen, sensor=R5_SENSOR):
+    """ Width and height (mm) of the subject area covered by one frame
+    dist = distance from lens to subject in mm
+    """
+    if dist <= focalLen:
+        raise ValueError("fieldOfView: subject is inside the focal length")
+    mag = focalLen / (dist - focalLen)
+    return sensor[0] / mag, sensor[1] / mag
+
+
+def tileOffsets(size, fov, overlap):
+    """ Offsets (mm) of tile origins covering size with the given overlap
+    """
+    if size <= fov:
+        return [0.0]
+    step = fov * (1 - overlap)
+    count = math.ceil((size - fov) / step) + 1
+    step = (size - fov) / (count - 1)  # spread the slack evenly
+    return [round(n * step, 2) for n in range(count)]
+
+
+def serpentine(xs, zs, rowsAlongX=True):
+    """ Visit order of a grid as (row, col) pairs, reversing every other pass
+    """
+    order = []
+    if rowsAlongX:
+        for row in range(len(zs)):
+            cols = range(len(xs)) if row % 2 == 0 else reversed(range(len(xs)))
+            order.extend((row, col) for col in cols)
+    else:
+        for col in range(len(xs)):
+            rows = range(len(zs)) if col % 2 == 0 else reversed(range(len(zs)))
+            order.extend((row, col) for row in rows)
+    return order
+
+
+def moveSeconds(dx, dz, xFeed=X_FEED, zFeed=Z_FEED, settle=TILE_SETTLE):
+    """ Time for one tile move, X and Z travel at the same time
+    """
+    if dx == 0 and dz == 0:
+        return 0.0
+    return max(abs(dx) * 60.0 / xFeed, abs(dz) * 60.0 / zFeed) + settle
+
+
+def orderCost(order, xs, zs, stackLen, yFeed=120):
+    """ Travel and settle seconds of a visit order, including the trip home
+    Stacks alternate Y direction so only the final trip home moves Y
+    """
+    seconds = 0.0
+    x = z = 0.0
+    for row, col in order:
+        seconds += moveSeconds(xs[col] - x, zs[row] - z)
+        x, z = xs[col], zs[row]
+    seconds += moveSeconds(-x, -z)
+    if len(order) % 2 == 1:
+        seconds += stackLen * 60.0 / yFeed  # odd count ends at the far Y end
+    return seconds
+
+
+def planMosaic(width, height, dist, focalLen, slicePositions, overlap=0.2,
+               shotDirection=1, sensor=R5_SENSOR):
+    """ Tile positions, visit order and stack direction of every tile
+
+    Inputs:
+       width - subject size along X in mm
+       height - subject size along Z in mm
+       dist - lens to subject distance in mm
+       focalLen - lens focal length in mm
+       slicePositions - Y positions of one stack (see stackingPositions)
+       overlap - fraction of a frame shared by neighbouring tiles
+       shotDirection - Y direction of the first stack
+
+    Returns:
+       plan - dictionary with the tile list (row, col, x, z, direction) in shooting
+              order, the field of view and the estimated travel seconds
+    """
+    fovX, fovZ = fieldOfView(dist, focalLen, sensor)
+    xs = tileOffsets(width, fovX, overlap)
+    zs = tileOffsets(height, fovZ, overlap)
+    stackLen = slicePositions[-1] if slicePositions else 0
+
+    best = None
+    for rowsAlongX in (True, False):
+        order = serpentine(xs, zs, rowsAlongX)
+        cost = orderCost(order, xs, zs, stackLen)
+        if best is None or cost < best[0]:
+            best = (cost, order)
+
+    tiles = []
+    for n, (row, col) in enumerate(best[1]):
+        tiles.append({"row": row, "col": col, "x": xs[col], "z": zs[row],
+                      "direction": shotDirection if n % 2 == 0 else -shotDirection})
+    return {"tiles": tiles, "fov": (round(fovX, 2), round(fovZ, 2)),
+            "travelSec": round(best[0], 1), "slicePositions": list(slicePositions),
+            "shotDirection": shotDirection}
+
+
+def stackPositions(slicePositions, forward, startY=0.0):
+    """ Positions handed to captureStack for a forward or reversed stack
+
+    Stacks start wherever the previous one ended (startY, measured like
+    slicePositions). A reversed stack shoots the same slice planes from the
+    last back to the first.
+    """
+    if forward:
+        return [round(y - startY, 2) for y in slicePositions]
+    return [round(startY - y, 2) for y in reversed(slicePositions)]
+
+
+def runMosaic(prtConn, r5Session, plan, outputDir="", transfer="copy", apiURL=API_URL,
+              onSaved=None, settings=None, brackets=None, settleModel=None, params=None):
+    """ Shoot every tile of a plan and write the tile index
+
+    The bed must be set up at the origin of the first tile (see setupPrinter).
+    settings, brackets and settleModel are passed on to captureStack, the
+    settle model also sets the dwell after each tile move. params are stored
+    in each tile's file when packing (transfer "pack"). A tile that stops
+    early ends the mosaic, the bed still returns to the first tile's origin.
+
+    Returns:
+       index - dictionary written to outputDir/mosaic_index.json
+    """
+    from macroPhotoShooter import captureStack  # avoid a circular import
+
+    frames = len(brackets) if brackets else 1
+    x = z = 0.0
+    y = 0.0  # bed Y, measured like slicePositions
+    index = {"fov": plan["fov"], "slicePositions": plan["slicePositions"], "tiles": []}
+    for tile in plan["tiles"]:
+        dx, dz = round(tile["x"] - x, 2), round(tile["z"] - z, 2)
+        if dx:
+            slowMove(prtConn, x=dx, feedRate=X_FEED,
+                     settle=None if settleModel is None else 0 if dz else settleModel.dwell(dx, X_FEED))
+        if dz:
+            slowMove(prtConn, z=dz, feedRate=Z_FEED,
+                     settle=None if settleModel is None else settleModel.dwell(dz, Z_FEED))
+        x, z = tile["x"], tile["z"]
+
+        forward = tile["direction"] == plan["shotDirection"]
+        positions = stackPositions(plan["slicePositions"], forward, y)
+        addedList, elapsed, endY = captureStack(
+            prtConn, r5Session, positions, tile["direction"], apiURL=apiURL,
+            settings=settings, brackets=brackets, settleModel=settleModel
+        )
+        y = round(y + endY if forward else y - endY, 2)  # where the bed really is
+        entry = dict(tile, files=addedList, elapsedSec=elapsed.total_seconds())
+        index["tiles"].append(entry)
+        if len(addedList) < len(positions) * frames:
+            print("\t Tile r{} c{} stopped early, stopping the mosaic".format(
+                tile["row"], tile["col"]))
+            break
+
+    # back to the origin of the first tile
+    slowMove(prtConn, x=-x, y=-round(y * plan["shotDirection"], 2), feedRate=X_FEED)
+    if z:
+        slowMove(prtConn, z=-z, feedRate=Z_FEED)
+
+    if transfer in ("copy", "preview", "pack"):
+        for entry in index["tiles"]:
+            tileDir = os.path.join(outputDir, "tile_r{}_c{}".format(entry["row"], entry["col"]))
+            if transfer == "pack":
+                tileDir += ".stack"
+                tileParams = dict(params or {}, row=entry["row"], col=entry["col"],
+                                  x=entry["x"], z=entry["z"], direction=entry["direction"])
+                positions = plan["slicePositions"]
+                if entry["direction"] != plan["shotDirection"]:
+                    positions = positions[::-1]  # reversed stacks shoot the last slice first
+                packFiles(r5Session, entry["files"], tileDir, positions, tileParams, frames,
+                          apiURL=apiURL)
+            elif transfer == "copy":
+                copyFiles(r5Session, entry["files"], onSaved=onSaved, dirName=tileDir,
+                          apiURL=apiURL)
+            else:
+                copyPreviews(r5Session, entry["files"], tileDir, apiURL=apiURL)
+            entry["dir"] = tileDir
+
+    if outputDir:
+        os.makedirs(outputDir, exist_ok=True)
+    with open(os.path.join(outputDir, INDEX_NAME), "w") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def main():
+    # test_1 - 150x80mm subject at 300mm with the 100mm macro
+    positions = [0.5, 1.0, 1.5, 2.0]
+    plan = planMosaic(150, 80, 300, 100, positions)
+    print("test_1: fov={} tiles={} travel={}s".format(
+        plan["fov"], len(plan["tiles"]), plan["travelSec"]))
+    for tile in plan["tiles"]:
+        print("\t row={row} col={col} x={x} z={z} direction={direction}".format(**tile))
+
+    # test_2 - a reversed stack shoots the same slice planes
+    print("test_2:", stackPositions(positions, True),
+          stackPositions(positions, False, 2.0), stackPositions(positions, True, 0.5))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+""" multiCamera.py
+    agent 19Oct2026
+
+    Fire several CCAPI cameras at every bed position.
+
+    Each camera gets its own session (client) and its own worker thread. At
+    each slice the bed moves, then all workers are released together by a
+    barrier and send their shutter press at the same moment, so N cameras
+    take about as long as one. Every camera's polling buffer is then read,
+    and the bed only moves on once each camera has a new file for the slice.
+    Only a camera without one is fired again (once), so a camera that shot
+    but did not confirm is not shot twice. A camera that still has no file
+    stops the stack, and the bed then returns from wherever it stopped.
+
+    Trigger skew is measured per slice: the spread of the times the presses
+    were sent and the spread of the times each camera accepted its press.
+    Each camera's files are kept apart and copied into their own folder.
+
+    Usage:
+       python multiCamera.py job.json http://192.168.1.188:8080 http://192.168.1.189:8080 ...
+    Jobs use the batchRunner.py job file format with the "copy", "preview" or
+    "none" transfer. Mosaic, profile, bracket and pipeline jobs are refused.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from r5_cameraUtils import (
+    createR5Session,
+    getLastEvent,
+    shootR5Image,
+    copyFiles,
+    preflightCheck,
+    printPreflight,
+)
+from gcodeUtils import (
+    connect3dPrinter,
+    setRelPositioning,
+    slowMove,
+)
+from previewTransfer import copyPreviews
+from settleModel import loadSettle
+from traceUtils import span
+from metricsUtils import inc, setGauge, observe
+
+TRIGGER_TIMEOUT = 10.0  # seconds a camera waits at the barrier for the others
+
+
+class Camera:
+    """ One camera of a multi-camera rig
+
+    Args:
+      name: label used in messages and as the folder its files are copied to
+      apiURL: CCAPI domain and port URL of the camera
+    """
+
+    def __init__(self, name, apiURL):
+        self.name = name
+        self.apiURL = apiURL
+        self.session = None
+        self.files = []
+        self.sentNs = 0  # shutter press sent
+        self.pressNs = 0  # shutter press accepted
+
+    def connect(self):
+        self.session, ready = createR5Session(self.apiURL)
+        return ready
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+    def fire(self, barrier):
+        """ Wait for the other cameras, then shoot. Returns True if confirmed
+        """
+        barrier.wait(TRIGGER_TIMEOUT)
+        self.sentNs = time.perf_counter_ns()
+        self.pressNs = 0
+        return shootR5Image(self.session, self.apiURL, af=False, onPress=self._pressed)
+
+    def _pressed(self, pressNs):
+        self.pressNs = pressNs
+
+    def pollFiles(self):
+        added = getLastEvent(self.session, self.apiURL).get("addedcontents") or []
+        self.files.extend(added)
+        return added
+
+
+def connectCameras(apiURLs):
+    """ Camera objects for apiURLs, all connected at the same time
+
+    Returns:
+       cameras - list of Camera. Raises ConnectionError if any did not connect
+    """
+    cameras = [Camera("cam{}".format(n + 1), apiURL) for n, apiURL in enumerate(apiURLs)]
+    with ThreadPoolExecutor(max_workers=max(len(cameras), 1)) as pool:
+        ready = list(pool.map(lambda cam: cam.connect(), cameras))
+    failed = [cam.apiURL for cam, ok in zip(cameras, ready) if not ok]
+    if failed:
+        for cam in cameras:
+            cam.close()
+        raise ConnectionError("cameras did not connect: " + ", ".join(failed))
+    return cameras
+
+
+def triggerAll(pool, cameras):
+    """ Fire every camera at once
+
+    Returns:
+       failed - cameras that did not confirm their shot
+       skew - (sent, accepted) spread of the shutter presses in ms
+    """
+    barrier = threading.Barrier(len(cameras))
+    futures = [pool.submit(cam.fire, barrier) for cam in cameras]
+    failed = []
+    for cam, future in zip(cameras, futures):
+        try:
+            ok = future.result()
+        except threading.BrokenBarrierError:
+            ok = False
+        if not ok:
+            failed.append(cam)
+    sent = [cam.sentNs for cam in cameras]
+    pressed = [cam.pressNs for cam in cameras if cam.pressNs]
+    skew = ((max(sent) - min(sent)) / 1e6,
+            (max(pressed) - min(pressed)) / 1e6 if len(pressed) == len(cameras) else None)
+    return failed, skew
+
+
+def pollAll(pool, cameras):
+    """ New files of each camera since its last poll
+    """
+    return list(pool.map(lambda cam: cam.pollFiles(), cameras))
+
+
+def withoutFile(pool, cameras):
+    """ Cameras that stored no new file since their last poll
+
+    Cameras without one are polled a second time, so a file stored late is
+    not taken for a missed shot
+    """
+    for poll in range(2):
+        cameras = [cam for cam, files in zip(cameras, pollAll(pool, cameras)) if not files]
+        if not cameras:
+            break
+    return cameras
+
+
+def captureMulti(prtConn, cameras, slicePositions, shotDirection, retries=1,
+                 settleModel=None):
+    """ Loop through bed moves and synchronised captures on every camera
+
+    Bed must already be at the shot's starting position (the origin).
+    settleModel is an optional settleModel.SettleModel (see captureStack).
+
+    Returns:
+      skews - (sent, accepted) trigger spread in ms of each completed slice
+      elapsed - timedelta of the shot sequence
+      endY - bed Y reached, measured like slicePositions. A camera that still
+             has no new file after retries stops the stack at that slice
+    """
+    slowMove(prtConn, y=0)
+    setRelPositioning(prtConn)
+    skews = []
+    with ThreadPoolExecutor(max_workers=len(cameras)) as pool:
+        list(pool.map(lambda cam: getLastEvent(cam.session, cam.apiURL), cameras))  # clear buffers
+
+        startTime = datetime.now()
+        prevY = 0.0
+        setGauge("mps_shots_remaining", len(slicePositions))
+        for shotNum, y in enumerate(slicePositions):
+            shotStart = time.perf_counter()
+            with span("shot", "shot", n=shotNum, y=y, cameras=len(cameras)):
+                dy = round((y - prevY) * shotDirection, 2)
+                slowMove(prtConn, y=dy,
+                         settle=None if settleModel is None else settleModel.dwell(dy))
+                prevY = y
+                _, skew = triggerAll(pool, cameras)
+                # a camera that did not confirm may still have shot, its file decides
+                missing = withoutFile(pool, cameras)
+                for attempt in range(retries):
+                    if not missing:
+                        break
+                    print("\t Retrying {} on slice {}".format(
+                        ", ".join(cam.name for cam in missing), shotNum))
+                    triggerAll(pool, missing)
+                    missing = withoutFile(pool, missing)
+                if missing:
+                    print("\t {} has no image of slice {}, stopping the stack".format(
+                        ", ".join(cam.name for cam in missing), shotNum))
+                    break
+                skews.append(skew)
+            observe("mps_shot_seconds", time.perf_counter() - shotStart)
+            inc("mps_shots_total")
+            setGauge("mps_shots_remaining", len(slicePositions) - shotNum - 1)
+        stopTime = datetime.now()
+
+        pollAll(pool, cameras)  # files stored after the last slice's poll
+    return skews, stopTime - startTime, prevY
+
+
+def printSkew(skews):
+    sent = [s for s, a in skews]
+    accepted = [a for s, a in skews if a is not None]
+    skewTxt = "\t Trigger skew over {n} slices: sent max {sMax:.1f}ms avg {sAvg:.1f}ms, accepted max {aMax:.1f}ms avg {aAvg:.1f}ms"
+    print(skewTxt.format(
+        n=len(skews), sMax=max(sent, default=0), sAvg=sum(sent) / max(len(sent), 1),
+        aMax=max(accepted, default=0), aAvg=sum(accepted) / max(len(accepted), 1)))
+
+
+def main():
+    from batchRunner import loadJob, planJob
+    from macroPhotoShooter import setupPrinter
+
+    parser = argparse.ArgumentParser(description="Shoot a job on several cameras at once")
+    parser.add_argument("job", help="job file")
+    parser.add_argument("apiURLs", nargs="+", help="CCAPI URL of each camera")
+    args = parser.parse_args()
+
+    job = loadJob(args.job)
+    unsupported = [key for key in ("mosaic", "profile", "bracket", "pipeline") if job.get(key)]
+    if job["transfer"] == "pack":
+        unsupported.append("pack transfer")
+    if unsupported:
+        raise SystemExit("\t multiCamera does not run jobs with " + ", ".join(unsupported))
+    positions = planJob(job)
+    prtConn, prtReady = connect3dPrinter()
+    if not prtReady:
+        sys.exit(1)
+    cameras = connectCameras(args.apiURLs)
+    try:
+        for cam in cameras:
+            report = preflightCheck(cam.session, len(positions), cam.apiURL)
+            printPreflight(report)
+            if not report["action"] == "ok":
+                raise RuntimeError("{}: {}".format(cam.name, report["reason"]))
+
+        setupPrinter(prtConn, homePrt=True, yAxis=job["yAxis"], zMove=job["zMove"])
+        skews, elapsed, endY = captureMulti(prtConn, cameras, positions, job["shotDirection"],
+                                            settleModel=loadSettle())
+        slowMove(prtConn, y=-round(endY * job["shotDirection"], 2))
+        print("\t {} of {} slices on {} cameras in {}".format(
+            len(skews), len(positions), len(cameras), elapsed))
+        printSkew(skews)
+
+        for cam in cameras:
+            camDir = os.path.join(job["outputDir"], cam.name)
+            if job["transfer"] == "copy":
+                copyFiles(cam.session, cam.files, dirName=camDir,
+                          apiURL=cam.apiURL)
+            elif job["transfer"] == "preview":
+                copyPreviews(cam.session, cam.files, camDir, apiURL=cam.apiURL)
+    finally:
+        for cam in cameras:
+            cam.close()
+        prtConn.close()
+
+
+if __name__ == "__main__":
+    main()
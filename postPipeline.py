@@ -0,0 +1,342 @@
+""" postPipeline.py
+    agent 19Oct2026
+
+    Process each image as soon as it lands on disk.
+
+    A Pipeline is handed to saveImageLocal/copyFiles as the onSaved function,
+    with shotNum (or numbered=True) so each file arrives with its shot number.
+    Every saved file becomes an item (path, slice number, bed Y, shot
+    parameters) on a bounded queue, and a small pool of worker threads runs
+    it through the registered stages in order. A full queue makes onSaved
+    wait, which slows the transfer rather than piling up work (backpressure).
+    Post-processing then ends a few seconds after the last image arrives
+    instead of starting then.
+
+    A CopyFeed starts the copies themselves while the stack is being shot:
+    captureStack hands it each slice's new files (onFiles) and its thread
+    saves them into the pipeline. Batch jobs with a pipeline use it, and the
+    menu's copy prompt runs the stages named in MPS_PIPELINE, i.e.
+       MPS_PIPELINE=rename,xmp,thumbnail python macroPhotoShooter.py
+    (a JSON list when a stacker is wanted).
+
+    A stage is any function taking the item dictionary and returning it (or
+    None to stop that item). A stage object with a finish() method is also
+    called once after the last item, i.e. to hand the whole stack over to a
+    stacking program. Built in stages, by name:
+       cache     - decode into the frame cache (see frameCache.py)
+       rename    - s003_IMG_1234.JPG, so files sort by slice. List it first
+                   so the other stages see the final name
+       xmp       - XMP sidecar with slice, bed Y and shot parameters. The
+                   images themselves are never rewritten
+       thumbnail - 320 pixel JPEG in a thumbs folder (requires Pillow)
+       {"stacker": [command ...]} - run a stacking program once every slice
+                   is in, "{files}" expands to the images in slice order and
+                   "{dir}" to their folder, i.e.
+                   {"stacker": ["focus-stack", "--output={dir}/stacked.jpg", "{files}"]}
+"""
+import os
+import time
+import queue
+import threading
+import json
+import subprocess
+from xml.sax.saxutils import quoteattr
+from r5_cameraUtils import API_URL, saveImageLocal
+from metricsUtils import setRig, setGauge, observe
+
+PIPELINE_WORKERS = 2
+PIPELINE_DEPTH = 8  # items waiting for a worker before onSaved blocks
+COPY_DEPTH = 8  # camera files waiting for the copy thread before the stack waits
+THUMB_SIZE = (320, 320)
+THUMB_DIR = "thumbs"
+
+
+class Pipeline:
+    """ Bounded worker pool running each saved image through stages
+
+    Args:
+      stages: list of stage functions, run in order on each item
+      positions: bed Y of each slice, the n-th image belongs to slice
+                 n // framesPerSlice
+      params: shot parameters added to every item
+      framesPerSlice: images per slice (more than one when bracketing)
+      workers: worker threads
+      depth: queue size
+      rigName: metrics label of the workers
+    """
+
+    def __init__(self, stages, positions=None, params=None, framesPerSlice=1,
+                 workers=PIPELINE_WORKERS, depth=PIPELINE_DEPTH, rigName=None):
+        self.stages = list(stages)
+        self.positions = positions or []
+        self.params = params or {}
+        self.framesPerSlice = framesPerSlice
+        self.rigName = rigName
+        self.queue = queue.Queue(maxsize=depth)
+        self.received = 0
+        self.done = []
+        self.errors = []
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._work, name="pipeline{}".format(n),
+                                         daemon=True) for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def onSaved(self, localPath, n=None):
+        """ saveImageLocal hook, blocks while the queue is full
+
+        n is the image's position in the shot list (see saveImageLocal
+        shotNum), so a failed download does not shift the slices after it.
+        Without it files are numbered in the order they are saved
+        """
+        if n is None:
+            n = self.received
+        sliceNum = n // self.framesPerSlice
+        item = {"path": localPath, "n": n, "slice": sliceNum,
+                "frame": n % self.framesPerSlice,
+                "y": self.positions[sliceNum] if sliceNum < len(self.positions) else None,
+                "params": self.params}
+        self.received += 1
+        self.queue.put(item)
+        setGauge("mps_pipeline_queue_depth", self.queue.qsize())
+
+    def _work(self):
+        if self.rigName:
+            setRig(self.rigName)
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            for stage in self.stages:
+                name = getattr(stage, "__name__", type(stage).__name__)
+                start = time.perf_counter()
+                try:
+                    item = stage(item)
+                except Exception as e:
+                    print("\t Pipeline stage {} failed on {}: {}".format(
+                        name, item["path"], e))
+                    with self.lock:
+                        self.errors.append((name, item["path"], str(e)))
+                    item = None
+                observe("mps_pipeline_stage_seconds", time.perf_counter() - start, stage=name)
+                if item is None:
+                    break
+            if item is not None:
+                with self.lock:
+                    self.done.append(item)
+
+    def close(self):
+        """ Wait for every item, then run the stages' finish() hooks
+
+        Returns:
+           done - items that went through every stage, in slice order
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.done.sort(key=lambda item: item["n"])
+        for stage in self.stages:
+            if hasattr(stage, "finish"):
+                try:
+                    stage.finish(self.done)
+                except Exception as e:
+                    print("\t Pipeline finish of {} failed: {}".format(type(stage).__name__, e))
+                    self.errors.append((type(stage).__name__, "", str(e)))
+        return self.done
+
+
+class CopyFeed:
+    """ Copy camera files on a thread while the stack is still being shot
+
+    Pass it to captureStack as onFiles. Files are queued in shooting order and
+    saved by saveImageLocal with their shot number, so onSaved (i.e.
+    Pipeline.onSaved) gets each image seconds after its slice. The queue is
+    bounded, a slow link makes the stack wait for room (backpressure).
+
+    Args:
+      session: Request.Session object connected to camera
+      localDir: folder the images are saved in
+      onSaved: called as onSaved(localPath, n) for each saved image
+      apiURL: domain and port URL of camera
+      depth: queue size
+    """
+
+    def __init__(self, session, localDir, onSaved=None, apiURL=API_URL, depth=COPY_DEPTH):
+        self.session = session
+        self.localDir = localDir
+        self.onSaved = onSaved
+        self.apiURL = apiURL
+        self.queue = queue.Queue(maxsize=depth)
+        self.images = []  # every file handed over, in shooting order
+        self.saved = []
+        self.failed = []
+        self.thread = threading.Thread(target=self._work, name="copy", daemon=True)
+        self.thread.start()
+
+    def __call__(self, files):
+        for resourcePath in files:
+            self.queue.put((len(self.images), resourcePath))  # blocks while full
+            self.images.append(resourcePath)
+            setGauge("mps_transfer_queue_depth", self.queue.qsize())
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            n, resourcePath = item
+            try:
+                success, fName = saveImageLocal(self.session, resourcePath, self.apiURL,
+                                                onSaved=self.onSaved, localDir=self.localDir,
+                                                shotNum=n)
+            except Exception as e:
+                # a failed image must not stop the thread, the stack would wait forever
+                print("\t CopyFeed: {} not copied: {}".format(resourcePath, e))
+                success = False
+            (self.saved if success else self.failed).append(resourcePath)
+
+    def close(self):
+        """ Wait for the queued copies. Returns the number of images saved
+        """
+        self.queue.put(None)
+        self.thread.join()
+        return len(self.saved)
+
+
+def cacheStage(item):
+    from macroPhotoShooter import cacheFrame  # skipped there without numpy/Pillow
+
+    cacheFrame(item["path"])
+    return item
+
+
+def renameStage(item):
+    dirName, name = os.path.split(item["path"])
+    newPath = os.path.join(dirName, "s{:03d}_{}".format(item["slice"], name))
+    os.replace(item["path"], newPath)
+    item["path"] = newPath
+    return item
+
+
+def xmpStage(item):
+    fields = {"slice": item["slice"], "frame": item["frame"]}
+    if item["y"] is not None:
+        fields["bedY"] = item["y"]
+    fields.update(item["params"])
+    attrs = "\n    ".join("mps:{}={}".format(key, quoteattr(str(value)))
+                          for key, value in fields.items() if value is not None)
+    sidecar = os.path.splitext(item["path"])[0] + ".xmp"
+    with open(sidecar, "w") as f:
+        f.write('<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+                ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+                '  <rdf:Description rdf:about=""\n'
+                '    xmlns:mps="http://github.com/poolsidebill/macroPhotoShooter/1.0/"\n'
+                '    {}/>\n'
+                ' </rdf:RDF>\n'
+                '</x:xmpmeta>\n'.format(attrs))
+    item["xmp"] = sidecar
+    return item
+
+
+def thumbnailStage(item):
+    from PIL import Image
+
+    if item["path"].upper().endswith(".CR3"):
+        return item  # Pillow can not decode raw files
+    dirName, name = os.path.split(item["path"])
+    thumbDir = os.path.join(dirName, THUMB_DIR)
+    os.makedirs(thumbDir, exist_ok=True)
+    thumbPath = os.path.join(thumbDir, os.path.splitext(name)[0] + ".jpg")
+    with Image.open(item["path"]) as img:
+        img.draft("RGB", THUMB_SIZE)  # JPEG decodes at reduced size, much faster
+        img.thumbnail(THUMB_SIZE)
+        img.convert("RGB").save(thumbPath, quality=85)
+    item["thumbnail"] = thumbPath
+    return item
+
+
+class StackerStage:
+    """ Hand the finished stack to an external stacking program
+
+    Args:
+      command: argument list, "{files}" expands to every image in slice order
+               and "{dir}" to their folder
+    """
+
+    def __init__(self, command):
+        self.command = list(command)
+        self.returncode = None
+
+    def __call__(self, item):
+        return item
+
+    def finish(self, items):
+        files = [item["path"] for item in items if not item["path"].upper().endswith(".CR3")]
+        if not files:
+            return
+        dirName = os.path.dirname(files[0])
+        args = []
+        for arg in self.command:
+            if arg == "{files}":
+                args.extend(files)
+            else:
+                args.append(arg.replace("{dir}", dirName))
+        print("\t Handing {} images to {}".format(len(files), args[0]))
+        self.returncode = subprocess.run(args).returncode
+        if self.returncode:
+            raise RuntimeError("{} exited with {}".format(args[0], self.returncode))
+
+
+STAGES = {
+    "cache": cacheStage,
+    "rename": renameStage,
+    "xmp": xmpStage,
+    "thumbnail": thumbnailStage,
+}
+
+
+def parseSpec(text):
+    """ Pipeline list from MPS_PIPELINE, comma separated names or a JSON list
+    """
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [name.strip() for name in text.split(",") if name.strip()]
+
+
+def buildStages(spec):
+    """ Stage list from a job's "pipeline" list of names and {"stacker": command}
+    """
+    stages = []
+    for entry in spec:
+        if isinstance(entry, dict) and "stacker" in entry:
+            stages.append(StackerStage(entry["stacker"]))
+        elif entry in STAGES:
+            stages.append(STAGES[entry])
+        else:
+            raise ValueError("unknown pipeline stage {}".format(entry))
+    return stages
+
+
+def main():
+    import tempfile
+    import shutil
+
+    # test_1 - rename, xmp and a stacker, the second image failed to download
+    workDir = tempfile.mkdtemp()
+    stages = buildStages(["rename", "xmp", {"stacker": ["ls", "{files}"]}])
+    pipeline = Pipeline(stages, positions=[0.5, 1.0, 1.5, 2.0], params={"fStop": 4}, depth=2)
+    for n in (0, 2, 3):
+        path = os.path.join(workDir, "IMG_{:04d}.JPG".format(n + 1))
+        with open(path, "wb") as f:
+            f.write(b"jpeg")
+        pipeline.onSaved(path, n)
+    done = pipeline.close()
+    print("test_1: done={} errors={}".format([os.path.basename(i["path"]) for i in done],
+                                             pipeline.errors))
+    print(open(done[1]["xmp"]).read())
+    shutil.rmtree(workDir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+""" previewTransfer.py
+    agent 19Oct2026
+
+    Review a stack from small previews, fetch the full files later.
+
+    CCAPI serves a "display" (about 1620x1080) and a "thumbnail" JPEG of every
+    image on the card. Copying these right after a stack takes a fraction of
+    the time and Wi-Fi bandwidth of the originals, and is plenty for checking
+    focus coverage, framing and lighting. Previews go into a "preview" folder
+    next to where the originals belong, with an index of which camera file
+    each one came from.
+
+    Originals (JPEG or CR3) are then fetched only for the slices picked, or
+    for all of them in an idle pass once the shooting is done. Files already
+    fetched are skipped.
+
+    Usage:
+       python previewTransfer.py outputDir [IMG_0003 IMG_0004 ...]
+    Fetches the originals of the named previews (all of them if none are named).
+"""
+import os
+import json
+import argparse
+from r5_cameraUtils import (
+    API_URL,
+    PREVIEW_KINDS,
+    createR5Session,
+    copyFiles,
+    saveImageLocal,
+)
+
+PREVIEW_DIR = "preview"
+PREVIEW_INDEX = "preview_index.json"
+PREVIEW_KIND = "display"
+
+
+def previewDir(dirName):
+    return os.path.join(dirName, PREVIEW_DIR)
+
+
+def readPreviewIndex(dirName):
+    """ Camera resource path -> preview file name of the previews in dirName
+    """
+    path = os.path.join(previewDir(dirName), PREVIEW_INDEX)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def addToPreviewIndex(dirName, resourcePaths):
+    """ Record previews saved for resourcePaths, keeping earlier entries
+    """
+    index = readPreviewIndex(dirName)
+    for resourcePath in resourcePaths:
+        index[resourcePath] = os.path.splitext(os.path.basename(resourcePath))[0] + ".JPG"
+    os.makedirs(previewDir(dirName), exist_ok=True)
+    path = os.path.join(previewDir(dirName), PREVIEW_INDEX)
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmpPath, path)
+
+
+def copyPreviews(session, addedList, dirName="", kind=PREVIEW_KIND, apiURL=API_URL):
+    """ Copy a small JPEG rendition of each image into dirName/preview
+
+    Returns:
+       results - boolean if files were saved
+    """
+    if kind not in PREVIEW_KINDS:
+        raise ValueError("copyPreviews: kind must be one of {}".format(PREVIEW_KINDS))
+    results = copyFiles(session, addedList, dirName=previewDir(dirName), apiURL=apiURL,
+                        kind=kind)
+    addToPreviewIndex(dirName, addedList)
+    return results
+
+
+def fetchOriginals(session, dirName="", names=None, apiURL=API_URL, onSaved=None):
+    """ Download the original files behind previews in dirName
+
+    Inputs:
+       names - preview names (with or without extension) to fetch originals of,
+               None fetches every one
+       onSaved - optional function called with the full local path of each saved file
+
+    Returns:
+       saved - local paths of the originals downloaded
+    """
+    wanted = None
+    if names is not None:
+        wanted = {os.path.splitext(os.path.basename(name))[0] for name in names}
+    saved = []
+    for resourcePath, previewName in sorted(readPreviewIndex(dirName).items()):
+        if wanted is not None and os.path.splitext(previewName)[0] not in wanted:
+            continue
+        if os.path.exists(os.path.join(dirName, os.path.basename(resourcePath))):
+            continue  # fetched on an earlier pass
+        success, fName = saveImageLocal(session, resourcePath, apiURL, onSaved=onSaved,
+                                        localDir=dirName)
+        if success:
+            saved.append(os.path.join(dirName, fName))
+        else:
+            print("\t fetchOriginals: could not fetch ", resourcePath)
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch originals of reviewed previews")
+    parser.add_argument("outputDir", help="folder holding the preview folder")
+    parser.add_argument("names", nargs="*", help="previews to fetch, default all")
+    args = parser.parse_args()
+
+    r5Session, camReady = createR5Session()
+    if not camReady:
+        raise SystemExit("\t Camera is not connected")
+    try:
+        saved = fetchOriginals(r5Session, args.outputDir, args.names or None)
+        print("\t {} originals fetched into {}".format(len(saved), args.outputDir or "."))
+    finally:
+        r5Session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,25 @@
     Helpful Canon R5 functions
 """
 import sys
-import traceback
 import time
 import math
 import os
-import requests
-from requests.exceptions import Timeout
+from traceUtils import span
+from metricsUtils import inc, observe
+# requests is imported inside the functions that use it, it takes a noticeable
+# part of a second to import and the menu should appear at once
 
 # Constants
 API_URL = "http://192.168.1.188:8080"  # my harcoded network endpoint for camera
 
 R5_COC = 0.00439  # pixelsize of R5 sensor
+R5_SHOTS_PER_BATTERY = 300  # full LP-E6NH with CCAPI Wi-Fi on, below the CIPA rating
+R5_AVG_FILE_SIZE = 12 * 1024**2  # large fine JPEG, used when the card is empty
+STATUS_TTL = 10.0  # seconds a devicestatus reply is reused before asking again
+PREVIEW_KINDS = ("display", "thumbnail")  # JPEG renditions CCAPI serves of any image
+BATTERY_LEVELS = {"full": 1.0, "high": 0.75, "half": 0.5, "quarter": 0.25, "low": 0.1}
+
+_statusCache = {}  # (apiURL, resource) -> (time fetched, reply dictionary)
 
 
 def createR5Session(apiUrl=API_URL):
@@ -21,7 +29,10 @@ def createR5Session(apiUrl=API_URL):
       from being refused by the camera
       Supressing full traceback, will print top-level exception
     """
+    import requests
+
     success = False
+    session = None
     try:
         sys.tracebacklimit = 10  # only the exception type and value are printed
         session = requests.Session()
@@ -31,8 +42,9 @@ def createR5Session(apiUrl=API_URL):
         )  # establish inital connection
         success = True
     except Exception as e:
-        session.close()
-        session = None 
+        if session is not None:
+            session.close()
+        session = None
         print("Exception detected in createR5Session")
         print(e)
         # print("-"*60)
@@ -42,6 +54,13 @@ def createR5Session(apiUrl=API_URL):
     return session, success
 
 
+def _traceName(method, resource):
+    # image paths are unique, trace them all under one name
+    if "/contents/" in resource:
+        resource = resource[: resource.index("/contents/") + 9]
+    return method + " " + resource.split("?")[0]
+
+
 def sendR5CcapiCmd(session, resource, cmdData, apiURL=API_URL):
     """ Command camera resource via a POST request
 
@@ -54,9 +73,12 @@ def sendR5CcapiCmd(session, resource, cmdData, apiURL=API_URL):
     Returns:
        resp - response payload from CCAPI
     """
+    import requests
+
     resp = {}
     try:
-        resp = session.post(apiURL + resource, json=cmdData, timeout=(2, 5))
+        with span(_traceName("POST", resource), "http", resource=resource):
+            resp = session.post(apiURL + resource, json=cmdData, timeout=(2, 5))
         # print(resp)
     except requests.exceptions.Timeout as errt:
         print("\t Timeout happened on request", errt)
@@ -77,9 +99,12 @@ def sendR5CcapiReq(session, resource, apiURL=API_URL):
     Returns:
        resp - response payload from CCAPI
     """
+    import requests
+
     resp = {}
     try:
-        resp = session.get(apiURL + resource, timeout=(2, 5))
+        with span(_traceName("GET", resource), "http", resource=resource):
+            resp = session.get(apiURL + resource, timeout=(2, 5))
         # print(resp)
     except requests.exceptions.Timeout as errt:
         print("\t Timeout happened on request", errt)
@@ -89,6 +114,32 @@ def sendR5CcapiReq(session, resource, apiURL=API_URL):
     return resp
 
 
+def sendR5CcapiPut(session, resource, cmdData, apiURL=API_URL):
+    """ Change a camera setting via a PUT request
+
+    Inputs:
+       session - Session object currently connected to camera
+       resource - CCAPI resource path
+       cmdData - dictionary of parameter:value data items to update
+       apiURL - domain and port URL
+
+    Returns:
+       resp - response payload from CCAPI
+    """
+    import requests
+
+    resp = {}
+    try:
+        with span(_traceName("PUT", resource), "http", resource=resource):
+            resp = session.put(apiURL + resource, json=cmdData, timeout=(2, 5))
+    except requests.exceptions.Timeout as errt:
+        print("\t Timeout happened on request", errt)
+    except requests.exceptions.ConnectionError as errc:
+        print("\t", errc)
+
+    return resp
+
+
 def sendR5CcapiDelete(session, resource, apiURL=API_URL):
     """ Remove data from camera via a DELETE request
 
@@ -100,9 +151,12 @@ def sendR5CcapiDelete(session, resource, apiURL=API_URL):
     Returns:
        resp - response payload from CCAPI
     """
+    import requests
+
     resp = {}
     try:
-        resp = session.delete(apiURL + resource, timeout=(2, 5))
+        with span(_traceName("DELETE", resource), "http", resource=resource):
+            resp = session.delete(apiURL + resource, timeout=(2, 5))
         # print(resp.status_code)
     except requests.exceptions.Timeout as errt:
         print("\t Timeout happened on request", errt)
@@ -131,23 +185,140 @@ def getCurrentDir(session, apiURL=API_URL):
     respDict = response.json()
     return respDict.get("name"), respDict.get("path")
 
-def reportBatteryStatus(session, apiURL=API_URL):
-    """ Determine the current folder for image captures
+def getDeviceStatus(session, resource, apiURL=API_URL, maxAge=STATUS_TTL):
+    """ Fetch a devicestatus resource, reusing a recent reply
 
-    Returns:
-      name - folder name (i.e. 111STRB3). If "", the media is not mounted in the camera
-      path - full path including name (i.e.  /ccapi/ver130/contents/sd/111STRB3).
-             If "", the media is not mounted in the camera
+    Inputs:
+       session - Session object currently connected to camera
+       resource - CCAPI resource path (i.e. /ccapi/ver100/devicestatus/battery)
+       apiURL - domain and port URL
+       maxAge - seconds a cached reply may be reused. 0 always asks the camera
+
+     Returns:
+       respDict - reply dictionary. Raises ConnectionError if the camera does not
+                  answer or answers with an error, error replies are not cached
     """
-    curDirReq = "/ccapi/ver100/devicestatus/battery"
-    response = sendR5CcapiReq(session, curDirReq, apiURL)
+    key = (apiURL, resource)
+    cached = _statusCache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < maxAge:
+        return cached[1]
+
+    response = sendR5CcapiReq(session, resource, apiURL)
+    if response == {}:
+        raise ConnectionError("camera did not answer " + resource)
+    if response.status_code != 200:
+        raise ConnectionError("camera answered {} to {}".format(response.status_code, resource))
     respDict = response.json()
+    _statusCache[key] = (time.monotonic(), respDict)
+    return respDict
+
+
+def reportBatteryStatus(session, apiURL=API_URL):
+    """ Print the camera battery status. Always asks the camera so it doubles
+    as a connection check
+    """
+    curDirReq = "/ccapi/ver100/devicestatus/battery"
+    respDict = getDeviceStatus(session, curDirReq, apiURL, maxAge=0)
     print("\t\t Camera Battery Status")
     for key,val in respDict.items():
         print("\t name: {} \t value: {}".format(key, val))
 
 
 
+def preflightCheck(session, numShots, apiURL=API_URL, avgFileSize=None):
+    """ Check the battery and card can hold a planned shoot before the bed moves
+
+    Battery level and free card space come from the cached devicestatus
+    replies. The average file size is taken from the images already on the
+    card, or R5_AVG_FILE_SIZE if it is empty. If the storage status can not
+    be read, only the battery limits the shoot and the reason says so.
+
+    Inputs:
+       session - Session object currently connected to camera
+       numShots - number of images planned
+       apiURL - domain and port URL
+       avgFileSize - bytes per image, overrides the estimate
+
+     Returns:
+       report - dictionary:
+         action - "ok" shoot everything, "split" shoot maxShots now and resume
+                  the rest after swapping battery/card, "refuse" do not start
+         maxShots - number of shots the camera can take now
+         batteryShots, storageShots - limit from each (None if unknown)
+         storageError - why the storage status is unknown, else None
+         battery - battery level reported by the camera
+         reason - text explaining the action
+    """
+    report = {"numShots": numShots, "batteryShots": None, "storageShots": None,
+              "storageError": None}
+    try:
+        battery = getDeviceStatus(session, "/ccapi/ver100/devicestatus/battery", apiURL)
+    except Exception as e:
+        report.update(action="refuse", maxShots=0, battery=None,
+                      reason="camera status unavailable: {}".format(e))
+        return report
+    try:
+        storage = getDeviceStatus(session, "/ccapi/ver110/devicestatus/storage", apiURL)
+    except Exception as e:
+        storage = None
+        report["storageError"] = str(e)
+
+    # battery: "unknown" is reported on the AC adapter, so no limit
+    report["battery"] = battery.get("level")
+    fraction = BATTERY_LEVELS.get(battery.get("level"))
+    if fraction is not None:
+        report["batteryShots"] = int(R5_SHOTS_PER_BATTERY * fraction)
+
+    # storage: the card holding the current folder, else the first writable one
+    cards = [c for c in (storage or {}).get("storagelist", [])
+             if c.get("accesscapability", "readwrite") == "readwrite"]
+    if storage is None:
+        pass  # unknown, no limit from the card
+    elif cards:
+        card = cards[0]
+        try:
+            curDir = getDeviceStatus(session, "/ccapi/ver110/devicestatus/currentdirectory", apiURL)
+            for c in cards:
+                if "/" + c.get("name", "") + "/" in (curDir.get("path") or ""):
+                    card = c
+        except Exception:
+            pass  # keep the first card
+        if avgFileSize is None:
+            used = card.get("maxsize", 0) - card.get("spacesize", 0)
+            count = card.get("contentsnumber", 0)
+            avgFileSize = used / count if count and used > 0 else R5_AVG_FILE_SIZE
+        report["storageShots"] = int(card.get("spacesize", 0) // max(avgFileSize, 1))
+    else:
+        report["storageShots"] = 0
+
+    limits = [n for n in (report["batteryShots"], report["storageShots"]) if n is not None]
+    report["maxShots"] = min(limits) if limits else numShots
+    if report["maxShots"] >= numShots:
+        report.update(action="ok", reason="battery and card hold all shots"
+                      if storage is not None else "battery holds all shots")
+    elif report["maxShots"] > 0:
+        short = "battery" if report["maxShots"] == report["batteryShots"] else "card"
+        report.update(action="split",
+                      reason="{} only holds {} of {} shots".format(
+                          short, report["maxShots"], numShots))
+    elif report["batteryShots"] == 0:
+        report.update(action="refuse", reason="battery empty")
+    elif not cards:
+        report.update(action="refuse", reason="no writable card")
+    else:
+        report.update(action="refuse", reason="card full")
+    if report["storageError"] is not None:
+        report["reason"] += " (storage status unknown: {})".format(report["storageError"])
+    return report
+
+
+def printPreflight(report):
+    preflightTxt = "\t Pre-flight: {act} - {why}\n\t   battery={bat} battery_shots={bs} card_shots={cs} planned={ns}"
+    print(preflightTxt.format(act=report["action"].upper(), why=report["reason"],
+                              bat=report["battery"], bs=report["batteryShots"],
+                              cs=report["storageShots"], ns=report["numShots"]))
+
+
 def getNumDirEntries(session, path, apiURL=API_URL):
     """ Get the number of entries in a folder and the number of pages required to get all the images
 
@@ -177,9 +348,11 @@ def getLastEvent(session, apiURL=API_URL):
     return respDict
 
 
-def shootR5Image(session, apiURL=API_URL, af=True):
+def shootR5Image(session, apiURL=API_URL, af=True, onPress=None):
     """ Capture a single picture image on the R5
     Handles rety if the camera is busy (i.e. storing a previous picture)
+    onPress - optional function called with time.perf_counter_ns() as soon as
+              the camera accepts the shutter press (used to measure trigger skew)
     """
     CTRL_BTN = "/ccapi/ver100/shooting/control/shutterbutton/manual"
     PRESS_PRAM = {"action": "full_press", "af": True}
@@ -191,26 +364,36 @@ def shootR5Image(session, apiURL=API_URL, af=True):
         paramDict["af"] = False
 
     while True:
-        result = sendR5CcapiCmd(
-            session, resource=CTRL_BTN, cmdData=PRESS_PRAM
-        )  # press shutter button
+        with span("shutter press", "camera"):
+            result = sendR5CcapiCmd(
+                session, resource=CTRL_BTN, cmdData=PRESS_PRAM, apiURL=apiURL
+            )  # press shutter button
+        pressNs = time.perf_counter_ns()
         # print("cmd sent. result:",result.status_code)
         print("cmd sent. result:", result)
-        time.sleep(0.15)
+        busy = result != {} and result.status_code == 503
+        if busy:
+            inc("mps_camera_busy_retries_total")
+        with span("camera busy retry" if busy else "press settle", "camera"):
+            time.sleep(0.15)
         if result == {}:
             return success  # serious error
-        if not result.status_code == 503:  # retry loop if camera is busy
+        if not busy:  # retry loop if camera is busy
             break
 
     # command was accepted, check its status
     if result and result.status_code == 200:
-        result = sendR5CcapiCmd(
-            session, resource=CTRL_BTN, cmdData=RELEASE_PRAM
-        )  # release shutter button
+        if onPress is not None:
+            onPress(pressNs)
+        with span("shutter release", "camera"):
+            result = sendR5CcapiCmd(
+                session, resource=CTRL_BTN, cmdData=RELEASE_PRAM, apiURL=apiURL
+            )  # release shutter button
         if result and result.status_code == 200:
             # Success
             print("Camera image captured")
-            time.sleep(0.4)  # give some time to store image
+            with span("store wait", "camera"):
+                time.sleep(0.4)  # give some time to store image
             success = True
         else:
             print("Camera command to release shutter button failed")
@@ -222,32 +405,102 @@ def shootR5Image(session, apiURL=API_URL, af=True):
     return success
 
 
-def getImage(session, imagePath, apiURL=API_URL):
+def setLiveView(session, size="small", apiURL=API_URL):
+    """ Start live view with frames of size ("small" or "medium"), "off" stops it
+
+    Returns:
+       success - True if the camera accepted the setting
+    """
+    LIVEVIEW = "/ccapi/ver100/shooting/liveview"
+    result = sendR5CcapiCmd(session, LIVEVIEW, {"liveviewsize": size, "cameradisplay": "on"},
+                            apiURL)
+    return bool(result) and result.status_code == 200
+
+
+def getLiveViewFrame(session, apiURL=API_URL):
+    """ Current live view frame as JPEG bytes, None if there is none
+    """
+    response = sendR5CcapiReq(session, "/ccapi/ver100/shooting/liveview/flip", apiURL)
+    if response == {} or response.status_code != 200:
+        return None
+    return response.content
+
+
+def getImage(session, imagePath, apiURL=API_URL, kind=None):
     """ Get an image from camera folder
 
     Retrieve an image and reports an error message if it was not able to
-    fetch it. Fetches the JPEG version of image
+    fetch it. Fetches the original file unless a smaller rendition is asked for
 
     Inputs:
        session - Session object currently connected to camera
        imagePath - CCAPI resource path of image to be fetched
                  (i.e. /ccapi/ver130/contents/sd/111STRB3/IMG_7935.JPG )
        apiURL - domain and port URL
+       kind - None for the original, or one of PREVIEW_KINDS for a JPEG rendition
+              ("display" is about 1620x1080, "thumbnail" 160x120)
 
      Returns:
        resp - response payload from CCAPI
     """
-    params = "?kind=display"  # fetch the JPEG version
+    if kind is not None:
+        imagePath += "?kind=" + kind
     response = sendR5CcapiReq(session, imagePath, apiURL)
     # print(" headers = ", response.headers)
     # print(" Content-Type = ", response.headers.get("Content-Type"))
     return response
 
 
-def copyFiles(session, addedList):
+def getImageStream(session, imagePath, apiURL=API_URL, kind=None):
+    """ Start fetching an image without reading its body
+
+    Same as getImage, but the body is read as it arrives with
+    resp.iter_content(), so it can be written out while downloading.
+
+     Returns:
+       resp - response from CCAPI, {} if the request failed
+    """
+    import requests
+
+    if kind is not None:
+        imagePath += "?kind=" + kind
+    resp = {}
+    try:
+        with span(_traceName("GET", imagePath), "http", resource=imagePath):
+            resp = session.get(apiURL + imagePath, timeout=(2, 5), stream=True)
+    except requests.exceptions.Timeout as errt:
+        print("\t Timeout happened on request", errt)
+    except requests.exceptions.ConnectionError as errc:
+        print("\t", errc)
+
+    return resp
+
+
+def getImageHead(session, imagePath, apiURL=API_URL):
+    """ Headers of an image (size, last modified) without any of its data
+
+     Returns:
+       resp - response to a HEAD request, {} if the request failed
+    """
+    import requests
+
+    resp = {}
+    try:
+        with span(_traceName("HEAD", imagePath), "http", resource=imagePath):
+            resp = session.head(apiURL + imagePath, timeout=(2, 5))
+    except requests.exceptions.Timeout as errt:
+        print("\t Timeout happened on request", errt)
+    except requests.exceptions.ConnectionError as errc:
+        print("\t", errc)
+
+    return resp
+
+
+def copyFiles(session, addedList, onSaved=None, dirName=None, apiURL=API_URL, kind=None,
+              numbered=False):
     """ Retrieve camera images and store them locally
 
-    Query user for a directory name to copy files into. Create the directory
+    Query user for a directory name to copy files into (unless dirName is given). Create the directory
     if needed. If no directory is specified, use current directory as the destination.
     Cycle through input list of resource images, fetch and save file locally. Names of
     files are listed after copied.
@@ -256,15 +509,22 @@ def copyFiles(session, addedList):
        session - Session object currently connected to camera
        addedList - List of CCAPI resource path(s) of image(s) to be fetched
                  (i.e. /ccapi/ver130/contents/sd/111STRB3/IMG_7935.JPG )
+       onSaved - optional function called with the full local path of each saved file
+       dirName - directory to copy files into. If None the user is prompted
+       apiURL - domain and port URL
+       kind - rendition to copy instead of the originals (see getImage)
+       numbered - also pass each file's index in addedList to onSaved (see saveImageLocal)
 
      Returns:
        results - boolean if files were saved
     """
     results = False
     # query for folder name and create it
-    dirName = input("\t Enter a directory name to create: ")
+    if dirName is None:
+        dirName = input("\t Enter a directory name to create: ")
     # print("\n\t input directory name = <{}>".format(dirName))
     currentDir = os.getcwd()
+    newDir = currentDir
     try:
         if dirName == "":
             print(
@@ -273,40 +533,50 @@ def copyFiles(session, addedList):
             )
         else:
             # create directory if it doesn't exist
-            newDir = currentDir + "/" + dirName
+            newDir = os.path.join(currentDir, dirName)
             if not os.path.exists(newDir):
-                os.mkdir(newDir)
-            os.chdir(newDir)  # go to specified directory
+                os.makedirs(newDir)
 
         # get files and copy them into local directory
-        for image in range(len(addedList)):
-            success, fName = saveImageLocal(session, addedList[image])
-            print("\t\t File: {} saved locally as {}".format(addedList[image], fName))
+        with span("copyFiles", "transfer", count=len(addedList)):
+            for image in range(len(addedList)):
+                success, fName = saveImageLocal(
+                    session, addedList[image], apiURL, onSaved=onSaved, localDir=newDir,
+                    kind=kind, shotNum=image if numbered else None
+                )
+                print("\t\t File: {} saved locally as {}".format(addedList[image], fName))
 
-        os.chdir(currentDir)  # got back to where we started
         print("")  # give us some space on the responses
         results = True
 
     except FileExistsError:
         print("\t Error: could not create new directory " + newDir)
     except FileNotFoundError:
-        # chdir() did not work or the path was not correct
+        # the path was not correct
         print("\t Error: unable to move into new directory " + newDir)
 
     return results
 
 
-def saveImageLocal(session, resourcePath, apiURL=API_URL):
+def saveImageLocal(session, resourcePath, apiURL=API_URL, onSaved=None, localDir="",
+                   kind=None, shotNum=None):
     """ Get an image from camera and save it locally
 
-    Retrieve an image from camera and save it in the current directory.
-    Saved file has same name as found in the resourcePath
+    Retrieve an image from camera and save it in localDir (default current directory).
+    Saved file has same name as found in the resourcePath. Renditions are always
+    JPEG, so they are saved with a .JPG extension
 
     Inputs:
        session - Session object currently connected to camera
        resourcePath - CCAPI resource path of image to be fetched and saved
                  (i.e. /ccapi/ver130/contents/sd/111STRB3/IMG_7935.JPG )
        apiURL - domain and port URL
+       onSaved - optional function called with the full local path of the saved
+                 file (i.e. frameCache.cacheFrame to decode it once, right away)
+       localDir - directory to save the file in
+       kind - rendition to fetch instead of the original (see getImage)
+       shotNum - position of the image in its shot list. When given it is passed
+                 to onSaved as a second argument, onSaved(localPath, shotNum)
 
      Returns:
        success  - True or False based on if file was saved locally or not
@@ -314,14 +584,32 @@ def saveImageLocal(session, resourcePath, apiURL=API_URL):
     """
     success = False
     filename = ""
-    result = getImage(session, resourcePath, apiURL)
-    if result.status_code == 200:
+    start = time.perf_counter()
+    with span("saveImageLocal", "transfer", resource=resourcePath, kind=kind):
+        result = getImage(session, resourcePath, apiURL, kind)
+    if result == {}:
+        print("saveImageLocal: no reply fetching ", resourcePath)  # timeout or lost link
+    elif result.status_code == 200:
+        observe("mps_transfer_seconds", time.perf_counter() - start)
+        inc("mps_transfer_bytes_total", len(result.content))
         pathList = resourcePath.split("/")  # parse the resource
         filename = pathList[-1]
-        with open(filename, "wb") as f:
+        if kind is not None:
+            filename = os.path.splitext(filename)[0] + ".JPG"
+        with open(os.path.join(localDir, filename), "wb") as f:
             f.write(result.content)
         f.close()
         success = True
+        if onSaved is not None:
+            try:
+                localPath = os.path.abspath(os.path.join(localDir, filename))
+                if shotNum is None:
+                    onSaved(localPath)
+                else:
+                    onSaved(localPath, shotNum)
+            except Exception as e:
+                # file is saved, a failed follow up step should not stop the copy
+                print("saveImageLocal: onSaved failed for ", filename, ": ", e)
     else:
         print(
             "saveImageLocal: Error saving file ",
@@ -383,6 +671,45 @@ def stackingDOF(dof):
     return round(dof * 0.8, 2)  # increase rounding for better percision
 
 
+def stackingPositions(dist, subjectLen, fStop=2.8, focalLen=100, coc=R5_COC, extraShots=2,
+                      shotDirection=1):
+    """ Bed Y position of every shot needed to cover a subject
+
+    Each bed move changes the distance from the lens to the slice in focus,
+    so the Depth Of Field is computed for every slice at its own distance
+    instead of once at the leading edge. Steps grow as the slices get further
+    away, giving the same coverage with fewer shots on deep subjects.
+    Shooting Back to Front starts at the far end of the subject, so the
+    slices there come first and the steps shrink as the bed nears the lens.
+    All distance args expected to be in millimeters
+
+    dist = distance to leading edge of subject in mm
+    subjectLen = length of subject in mm
+    extraShots = shots added past the end of the subject
+    shotDirection = 1 for Front to Back, -1 for Back to Front
+    Returns list of Y positions in mm (relative to start) rounded to 2 decimal places
+    """
+    def focusDist(y):
+        # distance to the slice in focus after moving the bed y mm
+        return dist + y if shotDirection > 0 else dist + subjectLen - y
+
+    positions = []
+    y = 0.0
+    while True:
+        step = stackingDOF(depthOfField(focusDist(y), fStop, focalLen, coc))
+        if step <= 0:
+            raise ValueError("stackingPositions: depth of field too small to step the bed")
+        if y + step > subjectLen:
+            break
+        y = round(y + step, 2)
+        positions.append(y)
+
+    for x in range(extraShots):
+        y = round(y + stackingDOF(depthOfField(focusDist(y), fStop, focalLen, coc)), 2)
+        positions.append(y)
+    return positions
+
+
 def hyperfocalDistance(focalLen=100, fStop=4, coc=R5_COC):
     hfd = math.pow(focalLen, 2) / (coc * fStop)
     return round(hfd, 3)
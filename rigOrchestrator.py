@@ -0,0 +1,327 @@
+""" rigOrchestrator.py
+    agent 19Oct2026
+
+    Drive several printer + camera rigs from one process.
+
+    Each Rig owns its own serial link, camera session and job, so nothing is
+    shared through module globals. Every rig runs its capture loop on its own
+    thread and hands new images to its own transfer thread through a bounded
+    queue. A rig with a slow Wi-Fi link only fills its own queue, and only that
+    rig waits for room (backpressure). The other rigs keep moving and shooting.
+
+    Example rig file:
+    [
+        {"name": "bench1", "port": "/dev/ttyUSB0",
+         "apiURL": "http://192.168.1.188:8080", "job": "jobs/beetle.json"},
+        {"name": "bench2", "port": "/dev/ttyUSB1",
+         "apiURL": "http://192.168.1.189:8080", "job": "jobs/moth.json"}
+    ]
+    Jobs use the batchRunner.py job file format. Rigs do not run mosaic,
+    profile or bracket jobs, and refuse them. A failed download is recorded
+    and the rig moves on. If transfers stall with the queue full for
+    TRANSFER_TIMEOUT seconds, the rig aborts instead of hanging mid-stack.
+
+    Usage:
+       python rigOrchestrator.py [--summary summary.json] [--metrics 9464] rigs.json
+"""
+import os
+import json
+import queue
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from r5_cameraUtils import (
+    API_URL,
+    createR5Session,
+    getLastEvent,
+    saveImageLocal,
+    preflightCheck,
+)
+from gcodeUtils import (
+    PRINTER_PORT,
+    connect3dPrinter,
+    slowMove,
+)
+from macroPhotoShooter import (
+    setupPrinter,
+    captureStack,
+)
+from previewTransfer import (
+    PREVIEW_KIND,
+    previewDir,
+    addToPreviewIndex,
+    fetchOriginals,
+)
+from settleModel import loadSettle
+from stackContainer import (
+    SPARE_ENTRIES,
+    StackWriter,
+    packImage,
+)
+from metricsUtils import (
+    setRig,
+    setGauge,
+    startMetricsServer,
+)
+from postPipeline import (
+    Pipeline,
+    buildStages,
+)
+from batchRunner import (
+    loadJob,
+    checkJob,
+    planJob,
+    writeSummary,
+    shotParams,
+)
+
+TRANSFER_DEPTH = 8  # images a rig may have waiting for transfer before it pauses
+TRANSFER_TIMEOUT = 120  # seconds a rig waits for room in its transfer queue before aborting
+RIG_UNSUPPORTED = ("mosaic", "profile", "bracket")  # job keys rigs do not run
+
+
+class Rig:
+    """ One printer + camera pair and the job it is shooting
+
+    Args:
+      name: label used in messages and the summary
+      port: serial port of the printer
+      apiURL: CCAPI domain and port URL of the camera
+      job: job dictionary (see batchRunner.checkJob)
+      transferDepth: size of the transfer queue
+    """
+
+    def __init__(self, name, port=PRINTER_PORT, apiURL=API_URL, job=None,
+                 transferDepth=TRANSFER_DEPTH):
+        self.name = name
+        self.port = port
+        self.apiURL = apiURL
+        self.job = job
+        self.prtConn = None
+        self.r5Session = None  # one CCAPI session, the camera serves a single client
+        self.transferQueue = queue.Queue(maxsize=transferDepth)
+        self.images = []
+        self.saved = []
+        self.failed = []  # (resource path, error) of transfers that did not complete
+        self.positions = []  # Y of each slice of the job
+        self.originals = []  # full files fetched after shooting a preview job
+        self.processed = []  # items through the job's post-capture pipeline
+        self.waitSec = 0.0  # time the capture loop spent waiting on transfers
+
+    def connect(self):
+        """ Open the printer and the camera session. Returns True if both worked
+        """
+        self.prtConn, prtReady = connect3dPrinter(self.port)
+        self.r5Session, camReady = createR5Session(self.apiURL)
+        return prtReady and camReady
+
+    def close(self):
+        for conn in (self.prtConn, self.r5Session):
+            if conn is not None:
+                conn.close()
+
+    def _onShot(self, shotNum, y):
+        # hand the new image(s) to the transfer thread as soon as they exist
+        addedList = getLastEvent(self.r5Session, self.apiURL).get("addedcontents")
+        for resourcePath in addedList or []:
+            self._queueImage(resourcePath)
+
+    def _queueImage(self, resourcePath):
+        n = len(self.images)  # shot order, a failed download never shifts it
+        self.images.append(resourcePath)
+        if self.job["transfer"] == "none":
+            return
+        start = datetime.now()
+        try:
+            # blocks while the queue is full
+            self.transferQueue.put((n, resourcePath), timeout=TRANSFER_TIMEOUT)
+        except queue.Full:
+            raise RuntimeError("transfers stalled for {}s".format(TRANSFER_TIMEOUT))
+        setGauge("mps_transfer_queue_depth", self.transferQueue.qsize())
+        self.waitSec += (datetime.now() - start).total_seconds()
+
+    def _transfer(self, n, resourcePath, localDir, writer, preview, onSaved):
+        if writer is not None:
+            return packImage(writer, self.r5Session, resourcePath, n,
+                             self.positions[n] if n < len(self.positions) else 0.0,
+                             self.apiURL)
+        if preview:
+            success, fName = saveImageLocal(
+                self.r5Session, resourcePath, self.apiURL,
+                localDir=previewDir(localDir), kind=PREVIEW_KIND
+            )
+        else:
+            success, fName = saveImageLocal(
+                self.r5Session, resourcePath, self.apiURL,
+                onSaved=onSaved, localDir=localDir, shotNum=n
+            )
+        return success
+
+    def _transferLoop(self, localDir):
+        setRig(self.name)
+        preview = self.job["transfer"] == "preview"
+        writer = None
+        pipeline = None
+        onSaved = None
+        setupError = None
+        try:
+            if self.job["transfer"] == "pack":
+                writer = StackWriter(os.path.join(localDir, self.job["name"] + ".stack"),
+                                     len(self.positions) + SPARE_ENTRIES, shotParams(self.job))
+            if self.job["pipeline"] and self.job["transfer"] == "copy":
+                # slices are processed while the rig is still shooting
+                pipeline = Pipeline(buildStages(self.job["pipeline"]), self.positions,
+                                    shotParams(self.job), rigName=self.name)
+                onSaved = pipeline.onSaved
+        except Exception as e:
+            print("\t [{}] transfers not started: {}".format(self.name, e))
+            setupError = str(e)
+        while True:
+            item = self.transferQueue.get()
+            setGauge("mps_transfer_queue_depth", self.transferQueue.qsize())
+            if item is None:
+                break
+            n, resourcePath = item
+            if setupError is not None:
+                self.failed.append((resourcePath, setupError))  # keep the queue moving
+                continue
+            try:
+                success = self._transfer(n, resourcePath, localDir, writer, preview, onSaved)
+            except Exception as e:
+                # a failed image must not stop the thread, the capture loop would wait forever
+                print("\t [{}] transfer error on {}: {}".format(self.name, resourcePath, e))
+                self.failed.append((resourcePath, str(e)))
+                continue
+            if success:
+                self.saved.append(resourcePath)
+            else:
+                print("\t [{}] transfer failed: {}".format(self.name, resourcePath))
+                self.failed.append((resourcePath, "not saved"))
+
+        if writer is not None:
+            writer.close()
+        if pipeline is not None:
+            self.processed = pipeline.close()
+        if preview:
+            addToPreviewIndex(localDir, self.saved)
+            if self.job["originals"] == "idle":
+                # capture loop is done, the link is free for the full files
+                self.originals = fetchOriginals(self.r5Session, localDir,
+                                                apiURL=self.apiURL)
+
+    def run(self):
+        """ Connect, shoot the job while transferring, and report
+
+        Returns:
+          result - dictionary summarising the rig's job
+        """
+        setRig(self.name)
+        job = self.job
+        result = {"rig": self.name, "name": job["name"], "status": "failed",
+                  "start": datetime.now().isoformat()}
+        localDir = job["outputDir"] or self.name
+        if job["transfer"] in ("copy", "pack"):
+            os.makedirs(localDir, exist_ok=True)
+        elif job["transfer"] == "preview":
+            os.makedirs(previewDir(localDir), exist_ok=True)
+        transfer = threading.Thread(
+            target=self._transferLoop, args=(localDir,), name=self.name + "-xfer"
+        )
+        try:
+            positions = planJob(job)
+            self.positions = positions
+            result["numShots"] = len(positions)
+            packPath = os.path.join(localDir, job["name"] + ".stack")
+            if job["transfer"] == "pack" and os.path.exists(packPath):
+                result["status"] = "refused"
+                raise FileExistsError("{} already holds a session".format(packPath))
+            if not self.connect():
+                raise ConnectionError("printer or camera did not connect")
+            report = preflightCheck(self.r5Session, len(positions), self.apiURL)
+            if not report["action"] == "ok":
+                result["status"] = "refused"
+                raise RuntimeError(report["reason"])
+            transfer.start()
+            setupPrinter(self.prtConn, homePrt=True, yAxis=job["yAxis"], zMove=job["zMove"])
+            addedList, elapsed, endY = captureStack(
+                self.prtConn, self.r5Session, positions, job["shotDirection"],
+                apiURL=self.apiURL, onShot=self._onShot, settleModel=loadSettle(self.name)
+            )
+            for resourcePath in addedList:  # captureStack drained the last events
+                self._queueImage(resourcePath)
+            slowMove(self.prtConn, y=-round(endY * job["shotDirection"], 2))
+            result["elapsedSec"] = elapsed.total_seconds()
+            result["status"] = "done" if len(self.images) >= len(positions) else "incomplete"
+        except Exception as ex:
+            print("\t [{}] {}: {}".format(self.name, result["status"], ex))
+            result["error"] = str(ex)
+        finally:
+            if transfer.is_alive():
+                self.transferQueue.put(None)
+                transfer.join()
+            self.close()
+        result["images"] = self.images
+        result["saved"] = len(self.saved)
+        result["failedTransfers"] = self.failed
+        result["originalsFetched"] = len(self.originals)
+        result["processed"] = len(self.processed)
+        result["transferWaitSec"] = round(self.waitSec, 2)
+        return result
+
+
+def loadRigs(rigPath):
+    """ Build Rig objects from a rig file
+    """
+    with open(rigPath) as f:
+        rigDefs = json.load(f)
+    rigs = []
+    for n, rigDef in enumerate(rigDefs):
+        job = rigDef["job"]
+        job = loadJob(job) if isinstance(job, str) else checkJob(job, rigPath)
+        unsupported = [key for key in RIG_UNSUPPORTED if job.get(key)]
+        if unsupported:
+            raise ValueError("rig {} job {} uses {}, which rigs do not run".format(
+                n + 1, job["name"], ", ".join(unsupported)))
+        rigs.append(Rig(
+            rigDef.get("name", "rig{}".format(n + 1)),
+            rigDef.get("port", PRINTER_PORT),
+            rigDef.get("apiURL", API_URL),
+            job,
+            rigDef.get("transferDepth", TRANSFER_DEPTH),
+        ))
+    return rigs
+
+
+def runRigs(rigs):
+    """ Run every rig at the same time, one thread per rig
+
+    Returns:
+       results - list of rig summaries in the order of rigs
+    """
+    with ThreadPoolExecutor(max_workers=max(len(rigs), 1)) as pool:
+        return list(pool.map(lambda rig: rig.run(), rigs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several rigs at once")
+    parser.add_argument("rigs", help="rig file")
+    parser.add_argument("--summary", default="rig_summary.json",
+                        help="where to write the results of every rig")
+    parser.add_argument("--metrics", type=int, metavar="PORT",
+                        help="serve live Prometheus metrics on this port")
+    args = parser.parse_args()
+    if args.metrics:
+        startMetricsServer(args.metrics)
+
+    rigs = loadRigs(args.rigs)
+    results = runRigs(rigs)
+    writeSummary(args.summary, results)
+    for result in results:
+        print("\t [{}] {} {} images, waited {}s on transfers".format(
+            result["rig"], result["status"], len(result["images"]),
+            result["transferWaitSec"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+""" settleModel.py
+    agent 19Oct2026
+
+    How long the bed needs to stop shaking after a move, measured per rig.
+
+    When M400 reports a move done the bed (and the subject on it) is still
+    ringing for a moment. A fixed sleep wastes time after the tiny steps of a
+    stack and may be too short after a long move. Calibration moves the bed
+    by several lengths at several feed rates, and watches the camera's live
+    view straight after each move: consecutive frames are differenced and the
+    bed counts as settled after the last frame that differed by more than the
+    noise seen with the bed at rest. Each point is measured a few times and the
+    worst is kept.
+
+    The result is stored per rig in settle/<rig>.json. dwell() interpolates it
+    for any move (with a safety margin) and captureStack hands that to
+    slowMove, which then skips its fixed per command delays. A move faster
+    than any calibrated feed rate gets no dwell (None), so slowMove keeps its
+    fixed delays for it.
+
+    Live view frames arrive about every 0.1-0.2 s over Wi-Fi, which sets the
+    resolution of the measurement. Calibration needs numpy and Pillow.
+
+    Usage (bed homed, subject and lighting as for a real stack):
+       python settleModel.py [--rig bench1]
+"""
+import os
+import io
+import json
+import time
+import bisect
+import argparse
+from r5_cameraUtils import (
+    API_URL,
+    createR5Session,
+    setLiveView,
+    getLiveViewFrame,
+)
+from gcodeUtils import (
+    connect3dPrinter,
+    setRelPositioning,
+    slowMove,
+)
+
+SETTLE_DIR = "settle"  # relative to the working directory
+RIG_NAME = "default"
+MOVE_LENGTHS = (0.1, 0.5, 2.0, 10.0)  # mm
+FEED_RATES = (120, 600)  # mm/min
+REPEATS = 3
+WATCH_SECONDS = 2.0  # live view watched after each move
+SETTLE_MARGIN = 1.25  # dwell() multiplier on the measured settle time
+MIN_DWELL = 0.05  # seconds, never trust a settle time below this
+
+
+class SettleModel:
+    """ Settle seconds measured for move lengths at each feed rate
+
+    Args:
+      table: {feedRate: [[length, seconds], ...]} with lengths ascending
+      margin: multiplier applied by dwell()
+    """
+
+    def __init__(self, table, margin=SETTLE_MARGIN, minDwell=MIN_DWELL):
+        self.table = {float(feed): sorted(points) for feed, points in table.items()}
+        self.margin = margin
+        self.minDwell = minDwell
+
+    def dwell(self, length, feedRate=120):
+        """ Minimum safe seconds to wait after a move of length mm at feedRate.
+        None if feedRate is faster than every calibrated feed
+        """
+        length = abs(length)
+        if not self.table:
+            return None
+        # the slowest calibrated feed at or above feedRate
+        feeds = sorted(self.table)
+        n = bisect.bisect_left(feeds, feedRate)
+        if n == len(feeds):
+            return None  # never measured, ringing may be worse than anything calibrated
+        if length == 0:
+            return 0.0
+        feed = feeds[n]
+        points = self.table[feed]
+        lengths = [p[0] for p in points]
+        n = bisect.bisect_left(lengths, length)
+        if n == 0:
+            seconds = points[0][1]
+        elif n == len(points):
+            seconds = points[-1][1]  # longer than calibrated, ringing has peaked by now
+        else:
+            (l0, s0), (l1, s1) = points[n - 1], points[n]
+            seconds = s0 + (s1 - s0) * (length - l0) / (l1 - l0)
+        return round(max(seconds * self.margin, self.minDwell), 3)
+
+    def save(self, rigName=RIG_NAME, settleDir=SETTLE_DIR):
+        os.makedirs(settleDir, exist_ok=True)
+        with open(os.path.join(settleDir, rigName + ".json"), "w") as f:
+            json.dump({"table": self.table, "margin": self.margin,
+                       "minDwell": self.minDwell}, f, indent=2)
+
+
+def loadSettle(rigName=RIG_NAME, settleDir=SETTLE_DIR):
+    """ Settle model of a rig, None if it was never calibrated
+    """
+    path = os.path.join(settleDir, rigName + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    return SettleModel(data["table"], data.get("margin", SETTLE_MARGIN),
+                       data.get("minDwell", MIN_DWELL))
+
+
+def _frameArray(jpeg):
+    import numpy as np
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(jpeg)).convert("L")
+    image.thumbnail((160, 160))
+    return np.asarray(image, dtype=np.float32)
+
+
+def watchFrames(r5Session, seconds, apiURL=API_URL):
+    """ Live view frames for seconds, as (seconds since start, mean abs
+    difference from the previous frame)
+    """
+    import numpy as np
+
+    diffs = []
+    start = time.perf_counter()
+    prev = None
+    while time.perf_counter() - start < seconds:
+        jpeg = getLiveViewFrame(r5Session, apiURL)
+        if jpeg is None:
+            continue
+        frame = _frameArray(jpeg)
+        if prev is not None and frame.shape == prev.shape:
+            diffs.append((time.perf_counter() - start, float(np.mean(np.abs(frame - prev)))))
+        prev = frame
+    return diffs
+
+
+def settleTime(diffs, threshold):
+    """ Time of the last frame change above threshold, 0 if there was none
+    """
+    moving = [t for t, diff in diffs if diff > threshold]
+    return moving[-1] if moving else 0.0
+
+
+def calibrate(prtConn, r5Session, apiURL=API_URL, lengths=MOVE_LENGTHS, feeds=FEED_RATES,
+              repeats=REPEATS):
+    """ Measure the settle time of every move length and feed rate
+
+    The bed moves forward and back by each length, so it ends where it began.
+
+    Returns:
+       model - SettleModel of the measurements
+    """
+    if not setLiveView(r5Session, apiURL=apiURL):
+        raise ConnectionError("calibrate: camera did not start live view")
+    try:
+        setRelPositioning(prtConn)
+        rest = [diff for t, diff in watchFrames(r5Session, WATCH_SECONDS, apiURL)]
+        if not rest:
+            raise ConnectionError("calibrate: no live view frames")
+        threshold = max(rest) * 1.5  # sensor noise and flicker with the bed still
+        print("\t Live view noise at rest: max {:.2f}, threshold {:.2f}".format(
+            max(rest), threshold))
+
+        table = {}
+        for feed in feeds:
+            points = []
+            for length in lengths:
+                worst = 0.0
+                for n in range(repeats * 2):
+                    direction = 1 if n % 2 == 0 else -1
+                    slowMove(prtConn, y=length * direction, feedRate=feed, settle=0)
+                    worst = max(worst, settleTime(
+                        watchFrames(r5Session, WATCH_SECONDS, apiURL), threshold))
+                points.append([length, round(worst, 3)])
+                print("\t feed {} mm/min, move {}mm: settled after {:.2f}s".format(
+                    feed, length, worst))
+            table[feed] = points
+    finally:
+        setLiveView(r5Session, "off", apiURL)
+    return SettleModel(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the bed settle time of a rig")
+    parser.add_argument("--rig", default=RIG_NAME, help="rig name the model is stored under")
+    parser.add_argument("--apiURL", default=API_URL)
+    args = parser.parse_args()
+
+    prtConn, prtReady = connect3dPrinter()
+    r5Session, camReady = createR5Session(args.apiURL)
+    if not (prtReady and camReady):
+        raise SystemExit("\t Printer connected: {}  Camera connected: {}".format(
+            prtReady, camReady))
+    try:
+        model = calibrate(prtConn, r5Session, args.apiURL)
+        model.save(args.rig)
+        print("\t Saved {}/{}.json".format(SETTLE_DIR, args.rig))
+        for length in (0.05, 0.25, 1.0, 5.0, 20.0):
+            print("\t dwell after {}mm at 120 mm/min: {}s".format(length, model.dwell(length)))
+    finally:
+        r5Session.close()
+        prtConn.close()
+
+
+if __name__ == "__main__":
+    main()
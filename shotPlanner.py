@@ -0,0 +1,196 @@
+""" shotPlanner.py
+    agent 19Oct2026
+
+    Pick the lens, aperture and distance that capture a subject with the
+    fewest shots, or the shortest session, while staying sharp.
+
+    depthOfField() works on one value at a time. Here the same formula is
+    evaluated over NumPy grids of every available f-stop, focal length and
+    distance at once. Shot counts walk the bed slice by slice like
+    stackingPositions(), each step taken from the Depth Of Field at that
+    slice's own distance, so a plan's count is the count that gets shot.
+    Stopping down gives more depth of field per shot but
+    diffraction softens the image, so plans whose Airy disk grows beyond the
+    sharpness target are rejected and plans close to it are penalised.
+
+    Plans are memoized by their input tuple so asking again is free.
+"""
+import functools
+import numpy as np
+from r5_cameraUtils import R5_COC
+
+# full, half and third stops available on the RF/EF 100mm macro lenses
+FSTOPS = (2.8, 3.2, 3.5, 4, 4.5, 5, 5.6, 6.3, 7.1, 8, 9, 10, 11, 13, 14, 16,
+          18, 20, 22, 25, 29, 32)
+WAVELENGTH = 0.00055  # green light in mm
+SECONDS_PER_SHOT = 1.1  # bed move + capture, same guess as printShotEstimate()
+STACK_OVERLAP = 0.8  # same overlap as stackingDOF()
+EXTRA_SHOTS = 2  # same padding as determineShotMovements()
+
+
+def magnification(dist, focalLen):
+    """ Thin lens magnification for a subject dist mm from the lens
+    NaN where the subject is inside the focal length (can not be focused)
+    """
+    dist = np.asarray(dist, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mag = focalLen / (dist - focalLen)
+    return np.where(dist > focalLen, mag, np.nan)
+
+
+def airyDisk(fStop, mag, wavelength=WAVELENGTH):
+    """ Diameter (mm) of the diffraction spot at the sensor
+    Uses the effective f-number, which grows with magnification
+    """
+    return 2.44 * wavelength * fStop * (1 + mag)
+
+
+def _stackStep(focus, N, f, coc):
+    # same rounding as stackingDOF(depthOfField())
+    dof = np.round(2 * focus**2 * N * coc / f**2, 3)
+    return np.round(dof * STACK_OVERLAP, 2)
+
+
+def _stackShots(subjectLen, N, f, d, coc, shotDirection):
+    """ Shots stackingPositions() takes for every grid point at once
+    """
+    def focusDist(y):
+        return d + y if shotDirection > 0 else d + subjectLen - y
+
+    shape = np.broadcast(N, f, d).shape
+    y = np.zeros(shape)
+    shots = np.zeros(shape)
+    active = np.broadcast_to(_stackStep(focusDist(y), N, f, coc) > 0, shape)
+    while active.any():
+        step = _stackStep(focusDist(y), N, f, coc)
+        active = active & (y + step <= subjectLen)
+        y = np.where(active, np.round(y + step, 2), y)
+        shots += active
+    return shots + EXTRA_SHOTS
+
+
+@functools.lru_cache(maxsize=256)
+def _planGrid(subjectLen, fStops, focalLens, distances, coc, sharpTarget,
+              penaltyWeight, secondsPerShot, baseExposure, baseFStop, shotDirection):
+    # grids are indexed [fStop, focalLen, distance]
+    N = np.asarray(fStops, dtype=float)[:, None, None]
+    f = np.asarray(focalLens, dtype=float)[None, :, None]
+    d = np.asarray(distances, dtype=float)[None, None, :]
+
+    dof = 2 * d**2 * N * coc / f**2  # same formula as depthOfField()
+    increment = np.round(dof * STACK_OVERLAP, 2)  # first step, at the leading edge
+    shots = _stackShots(subjectLen, N, f, d, coc, shotDirection)
+    exposure = baseExposure * (N / baseFStop) ** 2  # smaller apertures need more light
+    seconds = shots * (secondsPerShot + exposure)
+
+    airy = airyDisk(N, magnification(d, f))
+    ratio = airy / coc
+    valid = (ratio <= sharpTarget) & (increment > 0) & np.isfinite(ratio)
+    # soft penalty once diffraction blur is larger than a pixel
+    penalty = 1 + penaltyWeight * np.clip(ratio - 1, 0, None)
+
+    shape = np.broadcast(N, f, d).shape
+    return {
+        "fStop": np.broadcast_to(N, shape),
+        "focalLen": np.broadcast_to(f, shape),
+        "dist": np.broadcast_to(d, shape),
+        "dof": np.broadcast_to(dof, shape),
+        "increment": np.broadcast_to(increment, shape),
+        "numShots": np.broadcast_to(shots, shape),
+        "seconds": np.broadcast_to(seconds, shape),
+        "blurRatio": np.broadcast_to(ratio, shape),
+        "penalty": np.broadcast_to(penalty, shape),
+        "valid": np.broadcast_to(valid, shape),
+    }
+
+
+def planShots(subjectLen, distances, focalLens=(100,), fStops=FSTOPS,
+              objective="shots", coc=R5_COC, sharpTarget=2.0, penaltyWeight=0.25,
+              secondsPerShot=SECONDS_PER_SHOT, baseExposure=0.0, baseFStop=2.8,
+              count=5, shotDirection=1):
+    """ Best shot plans for a subject
+
+    Inputs:
+       subjectLen - length of subject in mm
+       distances - candidate lens to subject distances in mm (scalar or list)
+       focalLens - available lens focal lengths in mm
+       fStops - available f-stops
+       objective - "shots" for the fewest shots, "time" for shortest session
+       coc - Circle Of Confusion of the sensor in mm
+       sharpTarget - largest allowed Airy disk, in multiples of coc
+       penaltyWeight - cost added per coc of diffraction blur beyond one
+       secondsPerShot - bed move and capture time of a single shot
+       baseExposure - exposure time in seconds at baseFStop, 0 to ignore.
+                      Exposure time grows with the square of the f-stop
+       count - number of plans returned
+       shotDirection - 1 for Front to Back, -1 for Back to Front
+
+    Returns:
+       plans - list of dicts (fStop, focalLen, dist, dof, increment, numShots,
+               seconds, blurRatio), best first. Empty if nothing is valid
+    """
+    grid = _planGrid(
+        float(subjectLen),
+        tuple(float(n) for n in fStops),
+        tuple(float(f) for f in np.atleast_1d(focalLens)),
+        tuple(float(d) for d in np.atleast_1d(distances)),
+        float(coc),
+        float(sharpTarget),
+        float(penaltyWeight),
+        float(secondsPerShot),
+        float(baseExposure),
+        float(baseFStop),
+        1 if shotDirection > 0 else -1,
+    )
+    key = grid["numShots"] if objective == "shots" else grid["seconds"]
+    cost = np.where(grid["valid"], key * grid["penalty"], np.inf).ravel()
+    order = np.argsort(cost, kind="stable")
+
+    plans = []
+    for index in order[:count]:
+        if not np.isfinite(cost[index]):
+            break
+        plan = {name: grid[name].ravel()[index].item() for name in grid
+                if name not in ("valid", "penalty")}
+        plan["numShots"] = int(plan["numShots"])
+        plans.append(plan)
+    return plans
+
+
+def printPlans(plans):
+    planTxt = "\t {n:2d}) FStop={fs:<5} Lens={fl:.0f}mm distance={d:.0f}mm increment={i}mm shots={s:4d} time={t:6.0f}s diffraction={b:.2f}xCoC"
+    if not plans:
+        print("\t No valid plan. Try a longer distance or a lower sharpness target")
+    for n, plan in enumerate(plans, 1):
+        print(planTxt.format(n=n, fs=plan["fStop"], fl=plan["focalLen"], d=plan["dist"],
+                             i=plan["increment"], s=plan["numShots"],
+                             t=plan["seconds"], b=plan["blurRatio"]))
+
+
+def main():
+    # test_1 - 20mm subject at 300mm with the 100mm macro
+    plans = planShots(20, 300)
+    print("test_1: best plans")
+    printPlans(plans)
+
+    # test_2 - search distances and two lenses, shortest session with exposure cost
+    plans = planShots(20, np.arange(150, 601, 25), focalLens=(65, 100),
+                      objective="time", baseExposure=0.25)
+    print("test_2: best plans by session time")
+    printPlans(plans)
+
+    # test_3 - repeat request is answered from the memo
+    planShots(20, 300)
+    print("test_3:", _planGrid.cache_info())
+
+    # test_4 - planned counts match the positions actually shot
+    from r5_cameraUtils import stackingPositions
+
+    for direction in (1, -1):
+        plan = planShots(20, 300, fStops=(4,), shotDirection=direction)[0]
+        shot = len(stackingPositions(300, 20, 4, 100, shotDirection=direction))
+        print("test_4: direction={} planned={} shot={}".format(direction, plan["numShots"], shot))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+""" stackContainer.py
+    agent 19Oct2026
+
+    Pack a whole shooting session into one file.
+
+    A session copied with copyFiles is a folder of hundreds of loose images,
+    and the shot parameters are only printed. A .stack file instead holds
+    the shot parameters, an index and every image, uncompressed, one after
+    another:
+
+       header   magic, version, index capacity, entry count, params length
+       params   JSON shot parameters (fixed size block)
+       index    one fixed size entry per image: slice number, bed Y, offset,
+                size, blake2b hash and file name
+       data     the image files, back to back
+
+    Images are appended straight from the download stream, the index entry
+    is written after the image and the entry count last, so a file cut off
+    part way (crash, power cut) still opens with every complete image. An
+    existing file is only reopened for appending when resuming its session,
+    otherwise it is refused so two sessions never mix. Readers map the file
+    and return any image as a memoryview without extracting or copying it.
+
+    Usage:
+       python stackContainer.py info session.stack
+       python stackContainer.py extract session.stack outDir
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import hashlib
+from r5_cameraUtils import (
+    API_URL,
+    getImageStream,
+)
+from traceUtils import span
+from metricsUtils import inc, observe
+
+STACK_MAGIC = b"MPSSTACK"
+STACK_VERSION = 1
+HEADER = struct.Struct("<8sIIII")  # magic, version, capacity, count, params length
+ENTRY = struct.Struct("<IdQQ16s64s")  # slice, y, offset, size, hash, name
+PARAMS_SIZE = 8192
+CHUNK_SIZE = 256 * 1024
+SPARE_ENTRIES = 16  # index room beyond the planned shots, for retakes
+
+
+def _dataStart(capacity):
+    return HEADER.size + PARAMS_SIZE + capacity * ENTRY.size
+
+
+def _readHeader(f, path):
+    f.seek(0)
+    magic, version, capacity, count, paramsLen = HEADER.unpack(f.read(HEADER.size))
+    if magic != STACK_MAGIC or version != STACK_VERSION:
+        raise ValueError("stackContainer: {} is not a version {} stack file".format(
+            path, STACK_VERSION))
+    return capacity, count, paramsLen
+
+
+class StackWriter:
+    """ Append images to a .stack file
+
+    Args:
+      path: stack file
+      capacity: index entries to reserve when creating the file
+      params: shot parameters stored as JSON when creating the file
+      resume: reopen an existing file for appending, keeping its parameters.
+              Without it an existing file raises FileExistsError
+    """
+
+    def __init__(self, path, capacity=None, params=None, resume=False):
+        self.path = path
+        if os.path.exists(path):
+            if not resume:
+                raise FileExistsError("stackContainer: {} already holds a session".format(path))
+            params = None  # the session's own parameters stay
+            self.file = open(path, "r+b")
+            self.capacity, self.count, paramsLen = _readHeader(self.file, path)
+            # drop any image written after the last complete entry
+            self.end = _dataStart(self.capacity)
+            if self.count:
+                slice_, y, offset, size, digest, name = self._entry(self.count - 1)
+                self.end = offset + size
+            self.file.truncate(self.end)
+        else:
+            if not capacity:
+                raise ValueError("stackContainer: capacity is needed to create " + path)
+            dirName = os.path.dirname(path)
+            if dirName:
+                os.makedirs(dirName, exist_ok=True)
+            self.file = open(path, "w+b")
+            self.capacity = capacity
+            self.count = 0
+            self.end = _dataStart(capacity)
+            self.file.truncate(self.end)
+            self._writeHeader(0)
+        if params is not None:
+            self.setParams(params)
+
+    def _writeHeader(self, paramsLen=None):
+        if paramsLen is None:
+            self.file.seek(0)
+            paramsLen = HEADER.unpack(self.file.read(HEADER.size))[4]
+        self.file.seek(0)
+        self.file.write(HEADER.pack(STACK_MAGIC, STACK_VERSION, self.capacity,
+                                    self.count, paramsLen))
+
+    def _entry(self, n):
+        self.file.seek(HEADER.size + PARAMS_SIZE + n * ENTRY.size)
+        return ENTRY.unpack(self.file.read(ENTRY.size))
+
+    def setParams(self, params):
+        data = json.dumps(params).encode()
+        if len(data) > PARAMS_SIZE:
+            raise ValueError("stackContainer: shot parameters are over {} bytes".format(PARAMS_SIZE))
+        self.file.seek(HEADER.size)
+        self.file.write(data)
+        self._writeHeader(len(data))
+        self.file.flush()
+
+    def append(self, name, chunks, sliceNum, y=0.0):
+        """ Add one image, chunks is bytes or an iterable of bytes
+
+        Returns:
+           size - bytes written
+        """
+        if self.count >= self.capacity:
+            raise ValueError("stackContainer: index of {} is full".format(self.path))
+        if isinstance(chunks, (bytes, bytearray, memoryview)):
+            chunks = (chunks,)
+        digest = hashlib.blake2b(digest_size=16)
+        offset = self.end
+        self.file.seek(offset)
+        for chunk in chunks:
+            self.file.write(chunk)
+            digest.update(chunk)
+        size = self.file.tell() - offset
+        self.file.flush()
+
+        self.file.seek(HEADER.size + PARAMS_SIZE + self.count * ENTRY.size)
+        self.file.write(ENTRY.pack(sliceNum, y, offset, size, digest.digest(),
+                                   os.path.basename(name).encode()[:64]))
+        self.file.flush()
+        self.count += 1
+        self.end = offset + size
+        self._writeHeader()  # count goes last, readers never see a partial image
+        self.file.flush()
+        return size
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class StackReader:
+    """ Memory mapped view of a .stack file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.capacity, count, paramsLen = _readHeader(self.file, path)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        start = HEADER.size
+        self.params = json.loads(bytes(self.map[start:start + paramsLen])) if paramsLen else {}
+        self.entries = []
+        for n in range(count):
+            pos = HEADER.size + PARAMS_SIZE + n * ENTRY.size
+            slice_, y, offset, size, digest, name = ENTRY.unpack_from(self.map, pos)
+            if offset + size > len(self.map):
+                break  # cut off file, only whole images count
+            self.entries.append({"slice": slice_, "y": y, "offset": offset, "size": size,
+                                 "hash": digest.hex(), "name": name.rstrip(b"\0").decode()})
+
+    def __len__(self):
+        return len(self.entries)
+
+    def read(self, n):
+        """ Image n as a memoryview into the mapped file, no copy is made.
+        Release the view before close()
+        """
+        entry = self.entries[n]
+        return memoryview(self.map)[entry["offset"]:entry["offset"] + entry["size"]]
+
+    def verify(self, n):
+        return hashlib.blake2b(self.read(n), digest_size=16).hexdigest() == self.entries[n]["hash"]
+
+    def extract(self, outDir):
+        os.makedirs(outDir, exist_ok=True)
+        for n, entry in enumerate(self.entries):
+            with open(os.path.join(outDir, entry["name"]), "wb") as f:
+                f.write(self.read(n))
+        return len(self.entries)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def packImage(writer, session, resourcePath, sliceNum, y=0.0, apiURL=API_URL):
+    """ Stream one camera image into an open StackWriter
+
+    Returns:
+       success - True if the image was packed
+    """
+    start = time.perf_counter()
+    resp = getImageStream(session, resourcePath, apiURL)
+    if resp == {}:
+        print("\t packImage: could not fetch ", resourcePath)
+        return False
+    try:
+        if resp.status_code != 200:
+            print("\t packImage: could not fetch ", resourcePath)
+            return False
+        size = writer.append(resourcePath, resp.iter_content(CHUNK_SIZE), sliceNum, y)
+    finally:
+        resp.close()
+    observe("mps_transfer_seconds", time.perf_counter() - start)
+    inc("mps_transfer_bytes_total", size)
+    return True
+
+
+def packFiles(session, addedList, packPath, positions=None, params=None, framesPerSlice=1,
+              apiURL=API_URL, onPacked=None, capacity=None, resume=False, shotNums=None):
+    """ Download camera images straight into a .stack file
+
+    Inputs:
+       addedList - CCAPI resource paths in shooting order
+       positions - bed Y of each slice, image n of the session belongs to slice
+                   n // framesPerSlice (more than one frame per slice when bracketing)
+       params - shot parameters to store
+       onPacked - optional function called with packPath/<file name> of each image
+       capacity - images the whole session will hold, default len(addedList)
+       resume - append to the pack of an interrupted session (see StackWriter)
+       shotNums - n of each image in addedList, when it is not the whole
+                  session from its first image (i.e. the rest of a resumed one)
+
+    Returns:
+       count - number of images packed. An image that fails is skipped and
+               the rest are still packed
+    """
+    capacity = (capacity or len(addedList)) + SPARE_ENTRIES
+    if shotNums is None:
+        shotNums = range(len(addedList))
+    count = 0
+    with StackWriter(packPath, capacity, params, resume) as writer:
+        with span("packFiles", "transfer", count=len(addedList)):
+            for n, resourcePath in zip(shotNums, addedList):
+                sliceNum = n // framesPerSlice
+                y = positions[sliceNum] if positions and sliceNum < len(positions) else 0.0
+                try:
+                    if not packImage(writer, session, resourcePath, sliceNum, y, apiURL):
+                        continue
+                except Exception as e:
+                    print("\t packFiles: {} not packed: {}".format(resourcePath, e))
+                    continue
+                count += 1
+                if onPacked is not None:
+                    onPacked(os.path.join(packPath, os.path.basename(resourcePath)))
+                print("\t\t File: {} packed into {}".format(resourcePath, packPath))
+    return count
+
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] in ("info", "extract"):
+        with StackReader(sys.argv[2]) as reader:
+            if sys.argv[1] == "info":
+                print("\t Shot parameters: ", reader.params)
+                for n, entry in enumerate(reader.entries):
+                    print("\t {slice:>4} y={y:<8} {size:>10} {name}".format(**entry),
+                          "" if reader.verify(n) else "BAD HASH")
+            elif len(sys.argv) >= 4:
+                print("\t {} images extracted".format(reader.extract(sys.argv[3])))
+        return
+
+    # test_1 - pack, cut off a partial image, reopen, append and read back
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), "test.stack")
+    with StackWriter(path, capacity=4, params={"fStop": 4, "focalLen": 100}) as writer:
+        writer.append("IMG_0001.JPG", [b"a" * 1000, b"b" * 500], 0, 0.5)
+        writer.append("IMG_0002.JPG", b"c" * 2000, 1, 1.0)
+    with open(path, "ab") as f:
+        f.write(b"torn image")
+    try:
+        StackWriter(path, capacity=4, params={"fStop": 8})
+    except FileExistsError as e:
+        print("test_1: second session refused:", e)
+    with StackWriter(path, params={"fStop": 8}, resume=True) as writer:
+        writer.append("IMG_0003.JPG", b"d" * 10, 2, 1.5)
+    with StackReader(path) as reader:
+        print("test_1: params={} images={} sizes={} verified={} file={}".format(
+            reader.params, len(reader), [e["size"] for e in reader.entries],
+            all(reader.verify(n) for n in range(len(reader))), os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+    main()
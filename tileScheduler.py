@@ -0,0 +1,263 @@
+""" tileScheduler.py
+    agent 19Oct2026
+
+    Spread per-pixel work on an image stack across every CPU core.
+
+    A 200 slice stack of 45MP R5 images is far too much work for one Python
+    process. The output image is split into tiles and a process pool pulls
+    tiles one at a time (dynamic load balancing), so a slow tile never leaves
+    the other cores idle. Pixel data is never pickled: workers attach to the
+    input frames through shared memory or memory-mapped .npy files and write
+    their results straight into a shared output image.
+
+    The tile work supplied here is a simple focus stack: for each pixel keep
+    the slice with the highest local sharpness (smoothed Laplacian). The
+    resulting depth map (slice index per pixel) is the sharpness analysis.
+
+    Note:
+    1) Frames must all have the same shape, (height, width) or
+       (height, width, channels), and dtype.
+"""
+import os
+import sys
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+DEFAULT_TILE = 256  # tile edge in pixels
+DEFAULT_BLUR = 2  # radius of box filter applied to the sharpness measure
+DEPTH_DTYPE = np.uint16  # depth map dtype, allows up to 65535 slices
+
+# per worker views of the stack, set up once by _initWorker()
+_workerFrames = None
+_workerOutput = None
+_workerDepth = None
+_workerShm = []
+
+
+def planTiles(height, width, tileSize=DEFAULT_TILE):
+    """ Split an image into tiles
+
+    Inputs:
+       height, width - size of the output image in pixels
+       tileSize - tile edge in pixels. Edge tiles may be smaller
+
+    Returns:
+       tiles - list of (y0, y1, x0, x1) tuples, largest tiles first
+    """
+    tiles = []
+    for y0 in range(0, height, tileSize):
+        for x0 in range(0, width, tileSize):
+            tiles.append(
+                (y0, min(y0 + tileSize, height), x0, min(x0 + tileSize, width))
+            )
+    # hand out the big tiles first so small edge tiles fill in at the end
+    tiles.sort(key=lambda t: (t[1] - t[0]) * (t[3] - t[2]), reverse=True)
+    return tiles
+
+
+def shareArray(array):
+    """ Copy an array into a new shared memory block
+
+    Returns:
+       shm - SharedMemory object. Caller must close() and unlink() it
+       spec - small picklable description used by workers to attach
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, ("shm", shm.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    """ Open a view described by shareArray() or a list of .npy paths
+    """
+    if spec[0] == "shm":
+        shm = shared_memory.SharedMemory(name=spec[1])
+        _workerShm.append(shm)  # keep the block open as long as the worker lives
+        return np.ndarray(spec[2], dtype=np.dtype(spec[3]), buffer=shm.buf)
+    # ("npy", [paths]) - memory-map each frame, nothing is read until touched
+    return [np.load(path, mmap_mode="r") for path in spec[1]]
+
+
+def _initWorker(frameSpec, outputSpec, depthSpec):
+    global _workerFrames, _workerOutput, _workerDepth
+    _workerFrames = _attach(frameSpec)
+    _workerOutput = _attach(outputSpec)
+    _workerDepth = _attach(depthSpec)
+
+
+def _boxBlur(a, radius):
+    """ Mean filter of a 2d array using an integral image (edges clamped)
+    """
+    if radius <= 0:
+        return a
+    padded = np.pad(a, radius + 1, mode="edge")
+    ii = padded.cumsum(axis=0).cumsum(axis=1)
+    k = 2 * radius + 1
+    h, w = a.shape
+    s = ii[k:k + h, k:k + w] - ii[0:h, k:k + w] - ii[k:k + h, 0:w] + ii[0:h, 0:w]
+    return s / (k * k)
+
+
+def sharpness(tile, blur=DEFAULT_BLUR):
+    """ Local sharpness of an image region: |Laplacian| smoothed by a box filter
+    """
+    gray = tile.astype(np.float32)
+    if gray.ndim == 3:
+        gray = gray.mean(axis=2)
+    p = np.pad(gray, 1, mode="edge")
+    lap = np.abs(
+        4 * p[1:-1, 1:-1] - p[:-2, 1:-1] - p[2:, 1:-1] - p[1:-1, :-2] - p[1:-1, 2:]
+    )
+    return _boxBlur(lap, blur)
+
+
+def _stackTile(args):
+    """ Focus stack one tile in a worker, results written into shared output
+    """
+    (y0, y1, x0, x1), blur = args
+    halo = blur + 1  # extra border so the filters see real neighbours
+    h = _workerOutput.shape[0]
+    w = _workerOutput.shape[1]
+    hy0, hy1 = max(y0 - halo, 0), min(y1 + halo, h)
+    hx0, hx1 = max(x0 - halo, 0), min(x1 + halo, w)
+    inner = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+
+    bestScore = None
+    for index in range(len(_workerFrames)):
+        frame = _workerFrames[index]
+        score = sharpness(frame[hy0:hy1, hx0:hx1], blur)[inner]
+        if bestScore is None:
+            bestScore = score
+            _workerOutput[y0:y1, x0:x1] = frame[y0:y1, x0:x1]
+            _workerDepth[y0:y1, x0:x1] = 0
+            continue
+        better = score > bestScore
+        if better.any():
+            bestScore = np.where(better, score, bestScore)
+            _workerOutput[y0:y1, x0:x1][better] = frame[y0:y1, x0:x1][better]
+            _workerDepth[y0:y1, x0:x1][better] = index
+    return (y1 - y0) * (x1 - x0)
+
+
+def stackTiles(frameSpec, shape, dtype, workers=None, tileSize=DEFAULT_TILE,
+               blur=DEFAULT_BLUR):
+    """ Focus stack a set of frames using every core
+
+    Inputs:
+       frameSpec - ("shm", ...) spec from shareArray() of a (n, h, w[, c]) array,
+                   or ("npy", [paths]) of one .npy file per frame
+       shape - shape of a single frame (h, w[, c])
+       dtype - dtype of the frames
+       workers - number of processes. Default is one per core
+       tileSize - tile edge in pixels
+       blur - radius of the sharpness smoothing filter
+
+    Returns:
+       image - stacked output image
+       depth - slice index used for every pixel
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    dtype = np.dtype(dtype)
+    outShm = shared_memory.SharedMemory(
+        create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1)
+    )
+    depthShm = shared_memory.SharedMemory(
+        create=True,
+        size=max(shape[0] * shape[1] * np.dtype(DEPTH_DTYPE).itemsize, 1),
+    )
+    outSpec = ("shm", outShm.name, tuple(shape), dtype.str)
+    depthSpec = ("shm", depthShm.name, tuple(shape[:2]), np.dtype(DEPTH_DTYPE).str)
+    try:
+        tiles = planTiles(shape[0], shape[1], tileSize)
+        with mp.Pool(
+            workers, initializer=_initWorker, initargs=(frameSpec, outSpec, depthSpec)
+        ) as pool:
+            # chunksize=1 lets idle workers grab the next tile as soon as they finish
+            for _ in pool.imap_unordered(
+                _stackTile, [(t, blur) for t in tiles], chunksize=1
+            ):
+                pass
+        image = np.ndarray(shape, dtype=dtype, buffer=outShm.buf).copy()
+        depth = np.ndarray(shape[:2], dtype=DEPTH_DTYPE, buffer=depthShm.buf).copy()
+    finally:
+        for shm in (outShm, depthShm):
+            shm.close()
+            shm.unlink()
+    return image, depth
+
+
+def stackFrames(frames, workers=None, tileSize=DEFAULT_TILE, blur=DEFAULT_BLUR):
+    """ Focus stack an in-memory (n, h, w[, c]) array, see stackTiles()
+    """
+    shm, spec = shareArray(frames)
+    try:
+        return stackTiles(spec, frames.shape[1:], frames.dtype, workers, tileSize, blur)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def stackNpyFiles(paths, workers=None, tileSize=DEFAULT_TILE, blur=DEFAULT_BLUR):
+    """ Focus stack frames saved as .npy files, see stackTiles()
+    """
+    first = np.load(paths[0], mmap_mode="r")
+    return stackTiles(
+        ("npy", list(paths)), first.shape, first.dtype, workers, tileSize, blur
+    )
+
+
+def benchmark(numFrames=16, height=2000, width=3000, workerCounts=None):
+    """ Time stackFrames() on a synthetic stack for several worker counts
+
+    Returns:
+       results - list of (workers, seconds, megapixels per second, speedup)
+                 speedup is relative to the first worker count (1 by default)
+    """
+    rng = np.random.default_rng(1)
+    frames = rng.integers(0, 255, (numFrames, height, width, 3), dtype=np.uint8)
+    if workerCounts is None:
+        cores = os.cpu_count() or 1
+        workerCounts = sorted({1, 2, 4, 8, 16, 32, cores} & set(range(1, cores + 1)))
+
+    results = []
+    base = None
+    shm, spec = shareArray(frames)
+    try:
+        for workers in workerCounts:
+            start = time.perf_counter()
+            stackTiles(spec, frames.shape[1:], frames.dtype, workers)
+            elapsed = time.perf_counter() - start
+            if base is None:
+                base = elapsed
+            mpix = numFrames * height * width / 1e6 / elapsed
+            results.append((workers, elapsed, mpix, base / elapsed))
+    finally:
+        shm.close()
+        shm.unlink()
+    return results
+
+
+def main():
+    # test_1 - stacking picks the sharp slice for each half of the image
+    rng = np.random.default_rng(0)
+    sharp = rng.integers(0, 255, (64, 64), dtype=np.uint8)
+    flat = np.full((64, 64), 128, dtype=np.uint8)
+    a = np.where(np.arange(64) < 32, sharp, flat).astype(np.uint8)
+    b = np.where(np.arange(64) < 32, flat, sharp).astype(np.uint8)
+    image, depth = stackFrames(np.stack([a, b]), workers=2, tileSize=16)
+    print("test_1: left from slice 0:", (depth[:, 4:28] == 0).all(),
+          " right from slice 1:", (depth[:, 36:60] == 1).all())
+
+    # test_2 - throughput for 1..N cores
+    numFrames = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    benchTxt = "test_2: workers={w:3d}  time={t:7.2f}s  {mp:8.1f} MP/s  speedup={s:5.2f}x"
+    for workers, elapsed, mpix, speedup in benchmark(numFrames):
+        print(benchTxt.format(w=workers, t=elapsed, mp=mpix, s=speedup))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+""" traceUtils.py
+    agent 19Oct2026
+
+    Opt-in timeline of where a session's time goes.
+
+    Code wraps each phase (bed move, M400 wait, shutter press/release, camera
+    busy retries, HTTP requests, serial commands, file copies) in a span.
+    When tracing is off span() hands back one shared do-nothing object, so the
+    cost is a single function call. When on, each span is a perf_counter_ns()
+    pair appended to a list.
+
+    The trace is written as Chrome trace event JSON, which opens in
+    chrome://tracing or https://ui.perfetto.dev, and a table of the time
+    spent per shot in each phase is printed.
+
+    Turn it on with the MPS_TRACE environment variable:
+       MPS_TRACE=trace.json python macroPhotoShooter.py
+"""
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+
+_events = []  # (name, category, startNs, durationNs, threadId, args)
+enabled = False
+_traceFile = None
+
+
+class _Span:
+    __slots__ = ("name", "cat", "args", "start")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _events.append((self.name, self.cat, self.start, end - self.start,
+                        threading.get_ident(), self.args))
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, cat="", **args):
+    """ Context manager timing one phase, i.e. with span("slowMove", "motion"):
+    """
+    if not enabled:
+        return _NULL_SPAN
+    return _Span(name, cat, args)
+
+
+def enableTracing(traceFile="trace.json"):
+    """ Start recording. The trace is exported and summarised at exit
+    """
+    global enabled, _traceFile
+    if not enabled:
+        atexit.register(_exportAtExit)
+    enabled = True
+    _traceFile = traceFile
+
+
+def _exportAtExit():
+    if _events and _traceFile:
+        exportTrace(_traceFile)
+        print("\n\t Trace written to ", _traceFile)
+        printSummary()
+
+
+def exportTrace(traceFile):
+    """ Write recorded spans as Chrome trace event JSON
+    """
+    pid = os.getpid()
+    events = list(_events)
+    base = min((e[2] for e in events), default=0)
+    traceEvents = [
+        {"name": name, "cat": cat, "ph": "X", "pid": pid, "tid": tid,
+         "ts": (start - base) / 1000.0, "dur": dur / 1000.0, "args": args}
+        for name, cat, start, dur, tid, args in events
+    ]
+    with open(traceFile, "w") as f:
+        json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ms"}, f)
+
+
+def summarize(shotName="shot"):
+    """ Time spent in each phase while shooting
+
+    Spans recorded inside a shot span (same thread, same time) are charged to
+    that shot. Nested spans are listed on their own rows, i.e. "slowMove"
+    includes its "G0" and "M400" serial commands.
+
+    Returns:
+      numShots - number of shot spans
+      rows - list of (name, count, totalSec, msPerShot, percentOfShotTime),
+             largest total first
+    """
+    events = sorted(_events, key=lambda e: e[2])
+    starts = [e[2] for e in events]
+    shots = [e for e in events if e[0] == shotName]
+    shotTime = sum(e[3] for e in shots)
+    totals = {}
+    for shot in shots:
+        shotEnd = shot[2] + shot[3]
+        first = bisect.bisect_left(starts, shot[2])
+        for index in range(first, len(events)):
+            name, cat, start, dur, tid, args = events[index]
+            if start > shotEnd:
+                break
+            if (tid == shot[4] and start >= shot[2] and start + dur <= shotEnd
+                    and name != shotName):
+                count, total = totals.get(name, (0, 0))
+                totals[name] = (count + 1, total + dur)
+
+    rows = []
+    for name, (count, total) in totals.items():
+        rows.append((name, count, total / 1e9,
+                     total / 1e6 / max(len(shots), 1),
+                     100.0 * total / shotTime if shotTime else 0.0))
+    rows.sort(key=lambda r: r[2], reverse=True)
+    return len(shots), rows
+
+
+def printSummary(shotName="shot"):
+    numShots, rows = summarize(shotName)
+    rowTxt = "\t {name:<56} {count:>6} {total:>9.2f} {perShot:>9.1f} {pct:>6.1f}%"
+    print("\n\t Time per shot over {} shots".format(numShots))
+    print("\t {:<56} {:>6} {:>9} {:>9} {:>7}".format(
+        "phase", "count", "total s", "ms/shot", "share"))
+    for name, count, total, perShot, pct in rows:
+        print(rowTxt.format(name=name[:56], count=count, total=total,
+                            perShot=perShot, pct=pct))
+
+
+if os.environ.get("MPS_TRACE"):
+    enableTracing(os.environ["MPS_TRACE"])
+
+
+def main():
+    import tempfile
+
+    # test_1 - disabled spans are free
+    global enabled
+    saved = enabled
+    enabled = False
+    start = time.perf_counter()
+    for x in range(100000):
+        with span("off"):
+            pass
+    print("test_1: disabled span cost = {:.0f}ns".format(
+        (time.perf_counter() - start) * 1e4))
+
+    # test_2 - nested spans, export and summary
+    enabled = True
+    for shot in range(3):
+        with span("shot", "shot", n=shot):
+            with span("slowMove", "motion"):
+                time.sleep(0.02)
+            with span("shutter press", "camera"):
+                time.sleep(0.01)
+    path = os.path.join(tempfile.mkdtemp(), "trace.json")
+    exportTrace(path)
+    print("test_2: exported", len(json.load(open(path))["traceEvents"]), "events")
+    printSummary()
+    enabled = saved
+
+
+if __name__ == "__main__":
+    main()